@@ -0,0 +1,255 @@
+import argparse
+import bz2
+import gzip
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+DBO = "http://dbpedia.org/ontology/"
+
+# Predicate -> field stored in the index
+PREDICATES = {
+    RDF_TYPE: "type",
+    "http://xmlns.com/foaf/0.1/name": "name",
+    "http://www.w3.org/2000/01/rdf-schema#label": "name",
+    DBO + "abstract": "abstract",
+    DBO + "literaryGenre": "genres",
+    "http://purl.org/dc/terms/subject": "subjects",
+    DBO + "film": "adaptations",
+    DBO + "precedingWork": "preceding",
+    DBO + "subsequentWork": "subsequent",
+    DBO + "birthPlace": "birthplace",
+}
+
+ENTITY_KINDS = {DBO + "Book": "book", DBO + "Person": "person"}
+
+# One triple per line, as in N-Triples files and DBpedia's line-based .ttl dumps
+TRIPLE = re.compile(
+    r'^<([^>]*)>\s+<([^>]*)>\s+'
+    r'(?:<([^>]*)>|"((?:[^"\\]|\\.)*)"(?:@([A-Za-z0-9-]+)|\^\^<[^>]*>)?)'
+    r"\s*\.\s*$"
+)
+
+ESCAPE = re.compile(r"\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))")
+ESCAPED_CHARACTERS = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f"}
+
+
+def unescape_literal(value):
+    """
+    Decode the escape sequences of an N-Triples literal.
+    """
+
+    def replace(match):
+        if match.group(1) or match.group(2):
+            return chr(int(match.group(1) or match.group(2), 16))
+        return ESCAPED_CHARACTERS.get(match.group(3), match.group(3))
+
+    return ESCAPE.sub(replace, value)
+
+
+def normalize_name(name):
+    """
+    Key under which names are indexed and looked up: case, accents, punctuation and
+    whitespace differences are ignored.
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"[^\w\s]", " ", name.casefold())
+    return " ".join(name.split())
+
+
+def open_dump(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rt", encoding="utf-8")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+class DBpediaIndexBuilder:
+    def __init__(self, output_path):
+        """
+        Build an offline DBpedia lookup index (a SQLite file) from dump files.
+        """
+        self.output_path = output_path
+
+    def parse_dump(self, path):
+        """
+        Yield (uri, field, value, name_key) for the triples of a dump used by the index.
+        """
+        skipped = 0
+        with open_dump(path) as file:
+            for line in file:
+                if not line.startswith("<"):
+                    continue
+                match = TRIPLE.match(line)
+                if match is None:
+                    skipped += 1
+                    continue
+                subject, predicate, obj_uri, literal, lang = match.groups()
+                field = PREDICATES.get(predicate)
+                if field is None:
+                    continue
+                if field == "type":
+                    if obj_uri in ENTITY_KINDS:
+                        yield subject, field, ENTITY_KINDS[obj_uri], None
+                elif field == "name":
+                    if literal is not None and lang in (None, "en"):
+                        value = unescape_literal(literal)
+                        yield subject, field, value, normalize_name(value)
+                elif field == "abstract":
+                    if literal is not None and lang == "en":
+                        yield subject, field, unescape_literal(literal), None
+                else:
+                    value = obj_uri if obj_uri is not None else unescape_literal(literal)
+                    yield subject, field, value, None
+        if skipped:
+            logger.warning(f"Skipped {skipped} unparsable lines in '{path}'.")
+
+    def build(self, dump_paths, batch_size=100000):
+        """
+        Load the dumps into a staging table, then keep the names and properties of the
+        Book and Person entities only, resolving preceding/subsequent works to names.
+        """
+        start = time.perf_counter()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+        connection = sqlite3.connect(self.output_path)
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.execute(
+            "CREATE TABLE staging (uri TEXT, field TEXT, value TEXT, name_key TEXT)"
+        )
+        insert = "INSERT INTO staging VALUES (?, ?, ?, ?)"
+        for path in dump_paths:
+            batch = []
+            count = 0
+            for row in self.parse_dump(path):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    connection.executemany(insert, batch)
+                    count += len(batch)
+                    batch = []
+            connection.executemany(insert, batch)
+            count += len(batch)
+            connection.commit()
+            logger.info(f"Loaded {count} triples from '{path}'.")
+
+        connection.executescript(
+            """
+            CREATE INDEX staging_uri ON staging (uri, field);
+            CREATE TABLE entities AS
+                SELECT DISTINCT uri, value AS kind FROM staging WHERE field = 'type';
+            CREATE INDEX entities_uri ON entities (uri);
+            CREATE TABLE names AS
+                SELECT DISTINCT s.name_key, e.kind, s.uri
+                FROM staging s JOIN entities e ON e.uri = s.uri
+                WHERE s.field = 'name';
+            CREATE TABLE properties AS
+                SELECT DISTINCT s.uri, s.field, s.value
+                FROM staging s JOIN entities e ON e.uri = s.uri
+                WHERE s.field IN ('abstract', 'genres', 'subjects', 'adaptations', 'birthplace');
+            INSERT INTO properties
+                SELECT DISTINCT s.uri, s.field, n.value
+                FROM staging s
+                JOIN entities e ON e.uri = s.uri
+                JOIN staging n ON n.uri = s.value AND n.field = 'name'
+                WHERE s.field IN ('preceding', 'subsequent');
+            DROP TABLE staging;
+            DROP TABLE entities;
+            CREATE INDEX names_key ON names (name_key, kind);
+            CREATE INDEX properties_uri ON properties (uri);
+            """
+        )
+        connection.commit()
+        connection.execute("VACUUM")
+        names = connection.execute("SELECT COUNT(*) FROM names").fetchone()[0]
+        connection.close()
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"Built DBpedia index '{self.output_path}' ({names} names) in {elapsed:.1f}s."
+        )
+
+
+class DBpediaIndex:
+    def __init__(self, path, mmap_size=8 * 1024**3):
+        """
+        Read-only lookups in an index built by DBpediaIndexBuilder, memory-mapped so that
+        repeated lookups are served from the page cache.
+        """
+        self.connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        self.connection.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self.lock = threading.Lock()
+
+    def entity_properties(self, name, kind):
+        """
+        Return (field, value) rows of every entity of the given kind carrying the name.
+        """
+        with self.lock:
+            return self.connection.execute(
+                """
+                SELECT p.field, p.value
+                FROM names n JOIN properties p ON p.uri = n.uri
+                WHERE n.name_key = ? AND n.kind = ?
+                """,
+                (normalize_name(name), kind),
+            ).fetchall()
+
+    def book_metadata(self, title):
+        """
+        Metadata of a book in the format of DBpediaEnrichment.fetch_books_batch.
+        """
+        metadata = {
+            "description": None,
+            "genres": [],
+            "subjects": [],
+            "adaptations": [],
+            "preceding": [],
+            "subsequent": [],
+        }
+        for field, value in self.entity_properties(title, "book"):
+            if field == "abstract":
+                metadata["description"] = metadata["description"] or value
+            elif field in metadata and value not in metadata[field]:
+                metadata[field].append(value)
+        return metadata
+
+    def books_metadata(self, titles):
+        return {title: self.book_metadata(title) for title in dict.fromkeys(titles)}
+
+    def person_metadata(self, name):
+        """
+        Biography and birthplace of a person.
+        """
+        metadata = {"biography": None, "birthplace": None}
+        for field, value in self.entity_properties(name, "person"):
+            if field == "abstract":
+                metadata["biography"] = metadata["biography"] or value
+            elif field == "birthplace":
+                metadata["birthplace"] = metadata["birthplace"] or value
+        return metadata
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the offline DBpedia index from N-Triples/Turtle dump files "
+        "(optionally .bz2 or .gz compressed), e.g. the instance types, labels, abstracts, "
+        "mappingbased objects and article categories dumps."
+    )
+    parser.add_argument("dumps", nargs="+", help="dump files to index")
+    parser.add_argument("--output", default="dbpedia_index.sqlite")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    DBpediaIndexBuilder(args.output).build(args.dumps)
@@ -1,22 +1,69 @@
-import json
+import logging
+import threading
 from neo4j_manager import Neo4jConnector
-from DBPedia_manager import DBpediaConnector
+from DBPedia_manager import DBpediaConnector, DBpediaQueryError
+from DBPedia_index import DBpediaIndex
+from metrics import ProgressReporter, metrics
+from rate_limiter import map_bounded
 import re
 
+logger = logging.getLogger(__name__)
+
 
 class DBpediaEnrichment:
+    # Bump to re-enrich books processed by an older version of the DBpedia stage
+    PIPELINE_VERSION = 1
+
     def __init__(
         self,
         neo4j_uri,
         neo4j_user,
         neo4j_password,
         dbpedia_endpoint="http://dbpedia.org/sparql",
+        max_workers=4,
+        requests_per_minute=300,
+        max_retries=3,
+        offline_index=None,
+        cache=None,
     ):
         """
         Initialize the class with Neo4j connection details and a DBpediaConnector instance.
+        The batched mode fetches with max_workers threads, each with its own connector,
+        all sharing a polite limit of requests_per_minute on the endpoint.
+        When offline_index (a DBpediaIndex or the path of one, see DBPedia_index.py) is
+        given, every fetch is answered from the local index and no SPARQL query is sent.
+        Otherwise, SPARQL results are cached in cache (a ResponseCache) when given.
         """
         self.db = Neo4jConnector(neo4j_uri, neo4j_user, neo4j_password)
-        self.dbpedia = DBpediaConnector(dbpedia_endpoint)
+        self.dbpedia_endpoint = dbpedia_endpoint
+        self.max_workers = max_workers
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.cache = cache
+        self.connectors = []
+        self.connectors_lock = threading.Lock()
+        self.local = threading.local()
+        self.dbpedia = self.connector()
+        if isinstance(offline_index, str):
+            offline_index = DBpediaIndex(offline_index)
+        self.offline_index = offline_index
+
+    def connector(self):
+        """
+        Return the DBpediaConnector of the current thread, creating it on first use.
+        """
+        connector = getattr(self.local, "connector", None)
+        if connector is None:
+            connector = DBpediaConnector(
+                self.dbpedia_endpoint,
+                requests_per_minute=self.requests_per_minute,
+                max_retries=self.max_retries,
+                cache=self.cache,
+            )
+            self.local.connector = connector
+            with self.connectors_lock:
+                self.connectors.append(connector)
+        return connector
 
     def escape_sparql_string(self, value):
         """
@@ -24,10 +71,19 @@ class DBpediaEnrichment:
         """
         return re.sub(r'(["\\])', r"\\\1", value)
 
+    def unescape_sparql_string(self, value):
+        """
+        Undo escape_sparql_string, for lookups in the offline index.
+        """
+        return re.sub(r'\\(["\\])', r"\1", value)
+
     def fetch_author_biography(self, author_name):
         """
         Query DBpedia to fetch the biography of an author.
         """
+        if self.offline_index is not None:
+            name = self.unescape_sparql_string(author_name)
+            return self.offline_index.person_metadata(name)["biography"]
         query = f"""
         SELECT ?abstract WHERE {{
             ?author a dbo:Person ;
@@ -36,7 +92,7 @@ class DBpediaEnrichment:
             FILTER (lang(?abstract) = "en")
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
 
         if not results:
             # General query without language filter
@@ -47,7 +103,7 @@ class DBpediaEnrichment:
                     dbo:abstract ?abstract .
             }}
             """
-            results = self.dbpedia.query(query_no_lang)
+            results = self.dbpedia.query(query_no_lang, raise_errors=True)
 
         return results[0]["abstract"]["value"] if results else None
 
@@ -61,14 +117,17 @@ class DBpediaEnrichment:
                 "MATCH (a:Author {name: $name}) SET a.biography = $bio",
                 {"name": author_name, "bio": biography},
             )
-            print(f"Added biography for author '{author_name}'.")
+            logger.debug(f"Added biography for author '{author_name}'.")
         else:
-            print(f"No biography found for author '{author_name}'.")
+            logger.debug(f"No biography found for author '{author_name}'.")
 
     def fetch_author_birthplace(self, author_name):
         """
         Query DBpedia to fetch the birthplace of an author.
         """
+        if self.offline_index is not None:
+            name = self.unescape_sparql_string(author_name)
+            return self.offline_index.person_metadata(name)["birthplace"]
         query = f"""
         SELECT ?birthPlace WHERE {{
             ?author a dbo:Person ;
@@ -76,7 +135,7 @@ class DBpediaEnrichment:
                 dbo:birthPlace ?birthPlace .
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
         return results[0]["birthPlace"]["value"] if results else None
 
     def add_author_birthplace(self, author_name):
@@ -89,14 +148,17 @@ class DBpediaEnrichment:
                 "MATCH (a:Author {name: $name}) SET a.birthplace = $birthplace",
                 {"name": author_name, "birthplace": birthplace},
             )
-            print(f"Added birthplace for author '{author_name}'.")
+            logger.debug(f"Added birthplace for author '{author_name}'.")
         else:
-            print(f"No birthplace found for author '{author_name}'.")
+            logger.debug(f"No birthplace found for author '{author_name}'.")
 
     def fetch_book_genres(self, book_title):
         """
         Query DBpedia to fetch genres of a book.
         """
+        if self.offline_index is not None:
+            title = self.unescape_sparql_string(book_title)
+            return self.offline_index.book_metadata(title)["genres"]
         query = f"""
         SELECT ?genre WHERE {{
             ?book a dbo:Book ;
@@ -104,7 +166,7 @@ class DBpediaEnrichment:
                 dbo:literaryGenre ?genre .
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
         return [result["genre"]["value"] for result in results] if results else []
 
     def add_book_genres(self, book_title):
@@ -113,23 +175,31 @@ class DBpediaEnrichment:
         """
         genres = self.fetch_book_genres(book_title)
         if len(genres) == 0:
-            print(f"No genres found for book '{book_title}'.")
+            logger.debug(f"No genres found for book '{book_title}'.")
         else:
-            for genre in genres:
-                self.db.run_query(
-                    """
-                    MATCH (b:Book {name: $title})
-                    MERGE (g:Genre {name: $genre})
-                    MERGE (b)-[:HAS_GENRE]->(g)
-                    """,
-                    {"title": book_title, "genre": genre},
-                )
-            print(f"Added genres for book '{book_title}': {genres}")
+            self.db.run_many(
+                """
+                UNWIND $rows AS row
+                MATCH (b:Book {name: row.title})
+                MERGE (g:Genre {name: row.genre})
+                MERGE (b)-[:HAS_GENRE]->(g)
+                """,
+                [{"title": book_title, "genre": genre} for genre in genres],
+            )
+            logger.debug(f"Added genres for book '{book_title}': {genres}")
 
     def fetch_book_editions(self, book_title):
         """
         Query DBpedia to fetch relationships between book editions.
         """
+        if self.offline_index is not None:
+            book = self.offline_index.book_metadata(self.unescape_sparql_string(book_title))
+            if not book["subsequent"] or not book["preceding"]:
+                return {}
+            return {
+                "subsequentWork": {"value": book["subsequent"][0]},
+                "precedingWork": {"value": book["preceding"][0]},
+            }
         query = f"""
         SELECT ?subsequentWork ?precedingWork WHERE {{
             ?book a dbo:Book ;
@@ -138,7 +208,7 @@ class DBpediaEnrichment:
                 dbo:precedingWork ?precedingWork .
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
         return results[0] if results else {}
 
     def add_book_editions(self, book_title):
@@ -147,7 +217,7 @@ class DBpediaEnrichment:
         """
         editions = self.fetch_book_editions(book_title)
         if not editions:
-            print(f"No edition relationships found for book '{book_title}'.")
+            logger.debug(f"No edition relationships found for book '{book_title}'.")
         else:
             if editions.get("subsequentWork"):
                 self.db.run_query(
@@ -171,12 +241,15 @@ class DBpediaEnrichment:
                         "preceding": editions["precedingWork"]["value"],
                     },
                 )
-            print(f"Added edition relationships for book '{book_title}'.")
+            logger.debug(f"Added edition relationships for book '{book_title}'.")
 
     def fetch_book_subjects(self, book_title):
         """
         Query DBpedia to fetch subjects of a book.
         """
+        if self.offline_index is not None:
+            title = self.unescape_sparql_string(book_title)
+            return self.offline_index.book_metadata(title)["subjects"]
         query = f"""
         SELECT ?subject WHERE {{
             ?book a dbo:Book ;
@@ -184,7 +257,7 @@ class DBpediaEnrichment:
                 dct:subject ?subject .
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
         return [result["subject"]["value"] for result in results] if results else []
 
     def add_book_subjects(self, book_title):
@@ -193,23 +266,26 @@ class DBpediaEnrichment:
         """
         subjects = self.fetch_book_subjects(book_title)
         if len(subjects) == 0:
-            print(f"No subjects found for book '{book_title}'.")
+            logger.debug(f"No subjects found for book '{book_title}'.")
         else:
-            for subject in subjects:
-                self.db.run_query(
-                    """
-                    MATCH (b:Book {name: $title})
-                    MERGE (s:Subject {uri: $subject})
-                    MERGE (b)-[:HAS_SUBJECT]->(s)
-                    """,
-                    {"title": book_title, "subject": subject},
-                )
-            print(f"Added subjects for book '{book_title}': {subjects}")
+            self.db.run_many(
+                """
+                UNWIND $rows AS row
+                MATCH (b:Book {name: row.title})
+                MERGE (s:Subject {uri: row.subject})
+                MERGE (b)-[:HAS_SUBJECT]->(s)
+                """,
+                [{"title": book_title, "subject": subject} for subject in subjects],
+            )
+            logger.debug(f"Added subjects for book '{book_title}': {subjects}")
 
     def fetch_book_adaptations(self, book_title):
         """
         Query DBpedia to fetch film or TV adaptations of a book.
         """
+        if self.offline_index is not None:
+            title = self.unescape_sparql_string(book_title)
+            return self.offline_index.book_metadata(title)["adaptations"]
         query = f"""
         SELECT ?adaptation WHERE {{
             ?book a dbo:Book ;
@@ -217,7 +293,7 @@ class DBpediaEnrichment:
                 dbo:film ?adaptation .
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
         return [result["adaptation"]["value"] for result in results] if results else []
 
     def add_book_adaptations(self, book_title):
@@ -226,23 +302,26 @@ class DBpediaEnrichment:
         """
         adaptations = self.fetch_book_adaptations(book_title)
         if len(adaptations) == 0:
-            print(f"No adaptations found for book '{book_title}'.")
+            logger.debug(f"No adaptations found for book '{book_title}'.")
         else:
-            for adaptation in adaptations:
-                self.db.run_query(
-                    """
-                    MATCH (b:Book {name: $title})
-                    MERGE (a:Adaptation {uri: $adaptation})
-                    MERGE (b)-[:HAS_ADAPTATION]->(a)
-                    """,
-                    {"title": book_title, "adaptation": adaptation},
-                )
-            print(f"Added adaptations for book '{book_title}': {adaptations}")
+            self.db.run_many(
+                """
+                UNWIND $rows AS row
+                MATCH (b:Book {name: row.title})
+                MERGE (a:Adaptation {uri: row.adaptation})
+                MERGE (b)-[:HAS_ADAPTATION]->(a)
+                """,
+                [{"title": book_title, "adaptation": adaptation} for adaptation in adaptations],
+            )
+            logger.debug(f"Added adaptations for book '{book_title}': {adaptations}")
 
     def fetch_book_description(self, book_title):
         """
         Query DBpedia to fetch the description of a book.
         """
+        if self.offline_index is not None:
+            title = self.unescape_sparql_string(book_title)
+            return self.offline_index.book_metadata(title)["description"]
         query = f"""
         SELECT ?abstract WHERE {{
             ?book a dbo:Book ;
@@ -251,7 +330,7 @@ class DBpediaEnrichment:
             FILTER (lang(?abstract) = "en")
         }}
         """
-        results = self.dbpedia.query(query)
+        results = self.dbpedia.query(query, raise_errors=True)
         return results[0]["abstract"]["value"] if results else None
 
     def add_book_description(self, book_title):
@@ -264,7 +343,7 @@ class DBpediaEnrichment:
             {"title": book_title},
         )
         if existing_description and existing_description[0]["description"]:
-            print(f"Book '{book_title}' already has a description.")
+            logger.debug(f"Book '{book_title}' already has a description.")
             return
 
         description = self.fetch_book_description(book_title)
@@ -273,36 +352,403 @@ class DBpediaEnrichment:
                 "MATCH (b:Book {name: $title}) SET b.description = $description",
                 {"title": book_title, "description": description},
             )
-            print(f"Added description for book '{book_title}'.")
+            logger.debug(f"Added description for book '{book_title}'.")
         else:
-            print(f"No description found for book '{book_title}'.")
+            logger.debug(f"No description found for book '{book_title}'.")
 
-    def enrich_graph_with_dbpedia(self):
+    def fetch_books_batch(self, titles):
         """
-        Enrich the graph by adding metadata from DBpedia.
+        Query DBpedia once for the description, genres, subjects, adaptations and
+        preceding/subsequent works of many books, listing their titles in a VALUES block.
+        Each property is matched in its own UNION branch so that multi-valued properties
+        do not multiply each other's rows.
+
+        :param titles: Unescaped book titles.
+        :return: Dictionary mapping each title to its metadata.
+        :raises DBpediaQueryError: If the endpoint keeps failing, so that a failure is
+            never mistaken for books missing from DBpedia.
+        """
+        if self.offline_index is not None:
+            return self.offline_index.books_metadata(titles)
+        titles = list(dict.fromkeys(titles))
+        metadata = {
+            title: {
+                "description": None,
+                "genres": [],
+                "subjects": [],
+                "adaptations": [],
+                "preceding": [],
+                "subsequent": [],
+            }
+            for title in titles
+        }
+        if not titles:
+            return metadata
+        values = " ".join(f'"{self.escape_sparql_string(title)}"@en' for title in titles)
+        query = f"""
+        SELECT ?title ?property ?value WHERE {{
+            VALUES ?title {{ {values} }}
+            ?book a dbo:Book ;
+                foaf:name ?title .
+            {{
+                ?book dbo:abstract ?value .
+                FILTER (lang(?value) = "en")
+                BIND ("description" AS ?property)
+            }} UNION {{
+                ?book dbo:literaryGenre ?value .
+                BIND ("genres" AS ?property)
+            }} UNION {{
+                ?book dct:subject ?value .
+                BIND ("subjects" AS ?property)
+            }} UNION {{
+                ?book dbo:film ?value .
+                BIND ("adaptations" AS ?property)
+            }} UNION {{
+                ?book dbo:precedingWork ?work .
+                ?work foaf:name ?value .
+                BIND ("preceding" AS ?property)
+            }} UNION {{
+                ?book dbo:subsequentWork ?work .
+                ?work foaf:name ?value .
+                BIND ("subsequent" AS ?property)
+            }}
+        }}
+        """
+        for result in self.connector().query(query, raise_errors=True):
+            book = metadata.get(result["title"]["value"])
+            if book is None:
+                continue
+            prop = result["property"]["value"]
+            value = result["value"]["value"]
+            if prop == "description":
+                book["description"] = book["description"] or value
+            elif value not in book[prop]:
+                book[prop].append(value)
+        return metadata
+
+    def write_books_batch(self, books, metadata):
+        """
+        Write the DBpedia metadata of a batch of books keyed by Book.id in one transaction,
+        and mark the books as enriched by the current PIPELINE_VERSION.
+
+        :param books: Dictionaries with the id and name of each book.
+        :param metadata: Result of fetch_books_batch for the names of these books.
         """
-        # # Enrich authors
-        # authors = self.db.run_query("MATCH (a:Author) RETURN a.name AS name")
-        # for author in authors:
-        #     author_name = author["name"]
-        #     print(f"Processing author: '{author_name}'...")
-        #     self.add_author_biography(author_name)
-        #     self.add_author_birthplace(author_name)  # Enrich with birthplace
+        rows = [{"id": book["id"], **metadata[book["name"]]} for book in books]
+        self.db.run_in_transaction(
+            [
+                (
+                    """
+                    UNWIND $rows AS row
+                    MATCH (b:Book {id: row.id})
+                    SET b.description = coalesce(b.description, row.description),
+                        b.dbpedia_enriched_at = datetime(),
+                        b.dbpedia_pipeline_version = $version
+                    WITH b, row
+                    CALL {
+                        WITH b, row
+                        UNWIND row.genres AS genre
+                        MERGE (g:Genre {name: genre})
+                        MERGE (b)-[:HAS_GENRE]->(g)
+                    }
+                    CALL {
+                        WITH b, row
+                        UNWIND row.subjects AS subject
+                        MERGE (s:Subject {uri: subject})
+                        MERGE (b)-[:HAS_SUBJECT]->(s)
+                    }
+                    CALL {
+                        WITH b, row
+                        UNWIND row.adaptations AS adaptation
+                        MERGE (a:Adaptation {uri: adaptation})
+                        MERGE (b)-[:HAS_ADAPTATION]->(a)
+                    }
+                    CALL {
+                        WITH b, row
+                        UNWIND row.subsequent AS subsequent
+                        MATCH (b2:Book {name: subsequent})
+                        MERGE (b)-[:SUBSEQUENT_EDITION]->(b2)
+                    }
+                    CALL {
+                        WITH b, row
+                        UNWIND row.preceding AS preceding
+                        MATCH (b2:Book {name: preceding})
+                        MERGE (b)-[:PRECEDING_EDITION]->(b2)
+                    }
+                    """,
+                    {"rows": rows, "version": self.PIPELINE_VERSION},
+                )
+            ]
+        )
+        return sum(
+            1
+            for row in rows
+            if row["description"] or row["genres"] or row["subjects"] or row["adaptations"]
+        )
 
-        # Enrich books
-        books = self.db.run_query("MATCH (b:Book) RETURN b.id AS id, b.name AS name")
+    def iter_unprocessed_pages(self, page_size=1000):
+        """
+        Iterate over pages of the books that have not been enriched by the current
+        PIPELINE_VERSION of the DBpedia stage, using keyset pagination on Book.id.
+        """
+        books = self.db.iter_keyset(
+            """
+            MATCH (b:Book)
+            WHERE b.id > $last_key
+              AND (b.dbpedia_pipeline_version IS NULL
+                   OR b.dbpedia_pipeline_version < $version)
+            RETURN b.id AS id, b.name AS name
+            ORDER BY b.id LIMIT $page_size
+            """,
+            {"version": self.PIPELINE_VERSION},
+            page_size=page_size,
+        )
+        page = []
         for book in books:
-            book_title = book["name"]
-            escaped_title = self.escape_sparql_string(book_title)
-            print(f"Processing book: '{escaped_title}'...")
-            self.add_book_description(escaped_title)
-            self.add_book_genres(escaped_title)
-            self.add_book_subjects(escaped_title)
-            self.add_book_adaptations(escaped_title)
-            self.add_book_editions(escaped_title)
+            page.append(book)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def count_unprocessed(self, label):
+        """
+        Number of Book or Author nodes the current PIPELINE_VERSION still has to enrich,
+        for progress reporting.
+        """
+        record = self.db.run_query(
+            f"""
+            MATCH (n:{label})
+            WHERE n.dbpedia_pipeline_version IS NULL OR n.dbpedia_pipeline_version < $version
+            RETURN count(n) AS count
+            """,
+            {"version": self.PIPELINE_VERSION},
+            single=True,
+        )
+        return record["count"] if record else None
+
+    def mark_books_enriched(self, book_ids):
+        """
+        Record that the DBpedia stage of the current PIPELINE_VERSION processed these books.
+        """
+        self.db.run_query(
+            """
+            UNWIND $ids AS id
+            MATCH (b:Book {id: id})
+            SET b.dbpedia_enriched_at = datetime(), b.dbpedia_pipeline_version = $version
+            """,
+            {"ids": book_ids, "version": self.PIPELINE_VERSION},
+        )
+
+    def enrich_graph_with_dbpedia(self, page_size=1000):
+        """
+        Enrich the graph by adding metadata from DBpedia.
+        Books are read page by page with keyset pagination on Book.id and marked once
+        processed, so a restarted run skips the books the previous run completed. Books
+        whose SPARQL queries failed are left unmarked so the next run retries them.
+        """
+        # Enrich authors, many names per query instead of two queries per author
+        self.enrich_authors_batched(page_size=page_size)
+
+        # Enrich books, reusing one session for the many small queries
+        enriched = 0
+        failed = 0
+        with self.db.session():
+            for books in self.iter_unprocessed_pages(page_size):
+                done = []
+                for book in books:
+                    book_title = book["name"]
+                    escaped_title = self.escape_sparql_string(book_title)
+                    logger.debug(f"Processing book: '{escaped_title}'...")
+                    try:
+                        self.add_book_description(escaped_title)
+                        self.add_book_genres(escaped_title)
+                        self.add_book_subjects(escaped_title)
+                        self.add_book_adaptations(escaped_title)
+                        self.add_book_editions(escaped_title)
+                    except DBpediaQueryError as e:
+                        failed += 1
+                        logger.error(f"Error enriching book '{book_title}': {e}")
+                        continue
+                    done.append(book["id"])
+                if done:
+                    self.mark_books_enriched(done)
+                enriched += len(done)
+        metrics.inc("dbpedia_books_total", failed, outcome="failed")
+        logger.info(f"Enriched {enriched} books from DBpedia, {failed} failed.")
+
+    def iter_unprocessed_batches(self, batch_size, page_size):
+        """
+        Split the pages of unprocessed books into batches of batch_size books.
+        """
+        for books in self.iter_unprocessed_pages(page_size):
+            for i in range(0, len(books), batch_size):
+                yield books[i : i + batch_size]
+
+    def fetch_batch_metadata(self, books):
+        """
+        Fetch the DBpedia metadata of a batch of books, run on the worker threads.
+        """
+        return self.fetch_books_batch([book["name"] for book in books])
+
+    def enrich_graph_with_dbpedia_batched(self, batch_size=50, page_size=1000):
+        """
+        Enrich the graph like enrich_graph_with_dbpedia, resolving batch_size titles per
+        SPARQL request with fetch_books_batch and writing each batch in one transaction.
+        Up to max_workers requests run concurrently. Batches whose request failed are
+        left unmarked so the next run retries them.
+        """
+        self.enrich_authors_batched(batch_size, page_size)
+
+        enriched = 0
+        failed = 0
+        # the pages and the writes all run on this thread, they share a session
+        with self.db.session():
+            progress = ProgressReporter(
+                "DBpedia books", total=self.count_unprocessed("Book"), unit="books"
+            )
+            for books, metadata, error in map_bounded(
+                self.fetch_batch_metadata,
+                self.iter_unprocessed_batches(batch_size, page_size),
+                self.max_workers,
+            ):
+                if error is not None:
+                    failed += len(books)
+                    logger.error(f"Error fetching a batch of {len(books)} books: {error}")
+                    continue
+                enriched += self.write_books_batch(books, metadata)
+                progress.update(len(books), found=enriched, failed=failed)
+        metrics.inc("dbpedia_books_total", enriched, outcome="found")
+        metrics.inc("dbpedia_books_total", progress.done - enriched, outcome="not_found")
+        metrics.inc("dbpedia_books_total", failed, outcome="failed")
+        progress.finish(
+            found=enriched,
+            failed=failed,
+            sparql=DBpediaConnector.stats(self.connectors),
+        )
+
+    def fetch_authors_batch(self, names):
+        """
+        Query DBpedia once for the biography and birthplace of many authors, matching
+        their names against foaf:name or rdfs:label.
+
+        :param names: Unescaped author names.
+        :return: Dictionary mapping each name to its biography and birthplace.
+        :raises DBpediaQueryError: If the endpoint keeps failing.
+        """
+        names = list(dict.fromkeys(names))
+        if self.offline_index is not None:
+            return {name: self.offline_index.person_metadata(name) for name in names}
+        metadata = {name: {"biography": None, "birthplace": None} for name in names}
+        if not names:
+            return metadata
+        values = " ".join(f'"{self.escape_sparql_string(name)}"@en' for name in names)
+        query = f"""
+        SELECT ?name ?property ?value WHERE {{
+            VALUES ?name {{ {values} }}
+            ?author a dbo:Person ;
+                foaf:name|rdfs:label ?name .
+            {{
+                ?author dbo:abstract ?value .
+                FILTER (lang(?value) = "en")
+                BIND ("biography" AS ?property)
+            }} UNION {{
+                ?author dbo:birthPlace ?value .
+                BIND ("birthplace" AS ?property)
+            }}
+        }}
+        """
+        for result in self.connector().query(query, raise_errors=True):
+            author = metadata.get(result["name"]["value"])
+            if author is None:
+                continue
+            prop = result["property"]["value"]
+            author[prop] = author[prop] or result["value"]["value"]
+        return metadata
+
+    def write_authors_batch(self, names, metadata):
+        """
+        Write the biography and birthplace of a batch of authors with one UNWIND and mark
+        them as enriched by the current PIPELINE_VERSION. Return how many were found.
+        """
+        rows = [{"name": name, **metadata[name]} for name in names]
+        self.db.run_query(
+            """
+            UNWIND $rows AS row
+            MATCH (a:Author {name: row.name})
+            SET a.biography = coalesce(row.biography, a.biography),
+                a.birthplace = coalesce(row.birthplace, a.birthplace),
+                a.dbpedia_enriched_at = datetime(),
+                a.dbpedia_pipeline_version = $version
+            """,
+            {"rows": rows, "version": self.PIPELINE_VERSION},
+        )
+        return sum(1 for row in rows if row["biography"] or row["birthplace"])
+
+    def iter_unprocessed_author_batches(self, batch_size, page_size):
+        """
+        Iterate over batches of the distinct author names not enriched by the current
+        PIPELINE_VERSION, using keyset pagination on the unique Author.name.
+        """
+        authors = self.db.iter_keyset(
+            """
+            MATCH (a:Author)
+            WHERE a.name > $last_key
+              AND (a.dbpedia_pipeline_version IS NULL
+                   OR a.dbpedia_pipeline_version < $version)
+            RETURN a.name AS name
+            ORDER BY a.name LIMIT $page_size
+            """,
+            {"version": self.PIPELINE_VERSION},
+            key="name",
+            page_size=page_size,
+        )
+        batch = []
+        for author in authors:
+            batch.append(author["name"])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def enrich_authors_batched(self, batch_size=50, page_size=1000):
+        """
+        Enrich the authors with their DBpedia biography and birthplace, batch_size names
+        per SPARQL request and one write per batch, with up to max_workers requests in
+        flight. Batches whose request failed are left unmarked for the next run.
+        """
+        enriched = 0
+        failed = 0
+        with self.db.session():
+            progress = ProgressReporter(
+                "DBpedia authors", total=self.count_unprocessed("Author"), unit="authors"
+            )
+            for names, metadata, error in map_bounded(
+                self.fetch_authors_batch,
+                self.iter_unprocessed_author_batches(batch_size, page_size),
+                self.max_workers,
+            ):
+                if error is not None:
+                    failed += len(names)
+                    logger.error(f"Error fetching a batch of {len(names)} authors: {error}")
+                    continue
+                enriched += self.write_authors_batch(names, metadata)
+                progress.update(len(names), found=enriched, failed=failed)
+        metrics.inc("dbpedia_authors_total", enriched, outcome="found")
+        metrics.inc("dbpedia_authors_total", progress.done - enriched, outcome="not_found")
+        metrics.inc("dbpedia_authors_total", failed, outcome="failed")
+        hit_rate = enriched / progress.done if progress.done else 0.0
+        progress.finish(found=enriched, hit_rate=f"{hit_rate:.1%}", failed=failed)
 
     def close(self):
         """
-        Close the connection to the database.
+        Close the connection to the database, the offline index and the SPARQL cache.
         """
         self.db.close()
+        if self.offline_index is not None:
+            self.offline_index.close()
+        if self.cache is not None:
+            logger.info(f"SPARQL cache: {self.cache.stats()}")
+            self.cache.close()
@@ -1,4 +1,23 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from SPARQLWrapper import GET, JSON, POST, SPARQLWrapper
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
+from metrics import metrics
+from rate_limiter import RateLimiter, backoff_delay
+from response_cache import CacheMissError
+
+logger = logging.getLogger(__name__)
+
+
+class DBpediaQueryError(Exception):
+    """
+    Raised when a SPARQL query keeps failing, as opposed to returning no results.
+    """
 
 
 class DBpediaConnector:
@@ -9,19 +28,143 @@ class DBpediaConnector:
     PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
     """
 
-    def __init__(self, endpoint="http://dbpedia.org/sparql"):
+    # Queries longer than this (e.g. with large VALUES blocks) are sent with POST
+    MAX_GET_QUERY_LENGTH = 2000
+
+    # HTTP statuses worth retrying, other errors are raised or reported immediately
+    TRANSIENT_HTTP_STATUSES = {429, 500, 502, 503, 504}
+
+    # String literals are kept verbatim when normalizing the whitespace of a query
+    STRING_OR_WHITESPACE = re.compile(r'("(?:[^"\\]|\\.)*")|\s+')
+
+    # One rate limiter per endpoint, shared by every connector (and thread) using it
+    rate_limiters = {}
+    rate_limiters_lock = threading.Lock()
+
+    def __init__(
+        self,
+        endpoint="http://dbpedia.org/sparql",
+        requests_per_minute=None,
+        max_retries=3,
+        timeout=60,
+        cache=None,
+        empty_ttl_seconds=7 * 24 * 3600,
+    ):
+        """
+        Connect to a SPARQL endpoint. A connector is not thread safe, concurrent callers
+        should each use their own connector; they share the endpoint's rate limit.
+        Results are cached in cache (a ResponseCache, which may be shared by connectors)
+        keyed by the endpoint and the normalized query. Empty results are cached too, but
+        expire after empty_ttl_seconds so that books added to DBpedia are picked up.
+        """
+        self.endpoint = endpoint
+        self.cache = cache
+        self.empty_ttl_seconds = empty_ttl_seconds
         self.sparql = SPARQLWrapper(endpoint)
+        self.sparql.setTimeout(timeout)
+        self.max_retries = max_retries
+        self.rate_limiter = None
+        if requests_per_minute:
+            with DBpediaConnector.rate_limiters_lock:
+                self.rate_limiter = DBpediaConnector.rate_limiters.setdefault(
+                    endpoint, RateLimiter(requests_per_minute)
+                )
+        self.latencies = []
+        self.retries = 0
+        self.errors = 0
+        self.cache_hits = 0
+
+    def is_transient(self, error):
+        """
+        Whether a failed query may succeed if retried (timeouts, 5xx, 429, network errors).
+        """
+        if isinstance(error, EndPointInternalError):
+            return True
+        if isinstance(error, HTTPError):
+            return error.code in self.TRANSIENT_HTTP_STATUSES
+        return isinstance(error, (URLError, socket.timeout, TimeoutError, ConnectionError))
+
+    def normalize_query(self, sparql_query):
+        """
+        Collapse the whitespace outside string literals, so that the same query built
+        with a different indentation hits the same cache entry.
+        """
+        return self.STRING_OR_WHITESPACE.sub(
+            lambda match: match.group(1) or " ", sparql_query
+        ).strip()
 
-    def query(self, sparql_query):
+    def query(self, sparql_query, raise_errors=False):
         """
         Execute a SPARQL query and return the results as JSON.
+        Transient errors are retried with exponential backoff. When the query still fails,
+        DBpediaQueryError is raised if raise_errors is set, otherwise the error is logged
+        and an empty result is returned. Failures are never cached.
         """
         sparql_query = self.PREFIXES + sparql_query
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.endpoint, self.normalize_query(sparql_query))
+            cached = self.cache.get(key)
+            metrics.inc("sparql_cache_lookups_total", result="hit" if cached else "miss")
+            if cached is not None:
+                self.cache_hits += 1
+                return json.loads(cached)
+            if self.cache.read_only:
+                raise CacheMissError(f"SPARQL query not cached: {sparql_query}")
         self.sparql.setQuery(sparql_query)
         self.sparql.setReturnFormat(JSON)
-        try:
-            results = self.sparql.query().convert()
-            return results["results"]["bindings"]
-        except Exception as e:
-            print(f"Error executing SPARQL query: {e}")
-            return []
+        self.sparql.setMethod(
+            POST if len(sparql_query) > self.MAX_GET_QUERY_LENGTH else GET
+        )
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                results = self.sparql.query().convert()
+                self.latencies.append(time.perf_counter() - start)
+                metrics.observe("sparql_query_seconds", self.latencies[-1])
+                metrics.inc("sparql_queries_total", outcome="ok")
+                bindings = results["results"]["bindings"]
+                if key is not None:
+                    self.cache.set(
+                        key,
+                        json.dumps(bindings),
+                        ttl_seconds=None if bindings else self.empty_ttl_seconds,
+                    )
+                return bindings
+            except Exception as e:
+                error = e
+            metrics.observe("sparql_query_seconds", time.perf_counter() - start)
+            if not self.is_transient(error) or attempt == self.max_retries:
+                break
+            metrics.inc("sparql_queries_total", outcome="retry")
+            self.retries += 1
+            time.sleep(backoff_delay(attempt))
+        self.errors += 1
+        metrics.inc("sparql_queries_total", outcome="error")
+        if raise_errors:
+            raise DBpediaQueryError(f"SPARQL query failed: {error}") from error
+        logger.warning(f"Error executing SPARQL query: {error}")
+        return []
+
+    @staticmethod
+    def stats(connectors):
+        """
+        Summarize the query latencies, retries, errors and cache hits of one or more
+        connectors.
+        """
+        latencies = sorted(
+            latency for connector in connectors for latency in connector.latencies
+        )
+        count = len(latencies)
+        return {
+            "queries": count,
+            "mean_latency": sum(latencies) / count if count else 0.0,
+            "p50_latency": latencies[count // 2] if count else 0.0,
+            "p95_latency": latencies[int(count * 0.95)] if count else 0.0,
+            "max_latency": latencies[-1] if count else 0.0,
+            "retries": sum(connector.retries for connector in connectors),
+            "errors": sum(connector.errors for connector in connectors),
+            "cache_hits": sum(connector.cache_hits for connector in connectors),
+        }
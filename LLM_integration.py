@@ -1,76 +1,195 @@
-from openai import OpenAI
+import json
+import logging
+import os
+import threading
+import time
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    OpenAI,
+    RateLimitError,
+)
+from metrics import ProgressReporter, metrics
 from neo4j_manager import Neo4jConnector
+from rate_limiter import RateLimiter, backoff_delay, map_bounded
+from response_cache import CacheMissError
+from title_resolver import TitleResolver
+
+logger = logging.getLogger(__name__)
+
+# Rough upper bound of the completion length, used to reserve tokens-per-minute budget
+COMPLETION_TOKEN_ESTIMATE = 150
+
+# Function the model is forced to call in combined mode, its arguments carry every result
+ENRICHMENT_FUNCTION = {
+    "name": "record_book_enrichment",
+    "description": "Record the description, attributes and similar books of a book.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "description": {
+                "type": ["string", "null"],
+                "description": "Concise description of the book, null if not requested or unknown.",
+            },
+            "genre": {"type": "string", "description": 'Genre, or "unknown".'},
+            "themes": {"type": "string", "description": 'Main themes, or "unknown".'},
+            "audience": {"type": "string", "description": 'Target audience, or "unknown".'},
+            "similar_books": {
+                "type": "array",
+                "items": {"type": "string"},
+                "maxItems": 3,
+                "description": "Titles of up to 3 similar books.",
+            },
+        },
+        "required": ["description", "genre", "themes", "audience", "similar_books"],
+    },
+}
+
+# Function used to enrich several books with one request, one array item per book
+PACKED_ENRICHMENT_FUNCTION = {
+    "name": "record_books_enrichment",
+    "description": "Record the description, attributes and similar books of several books.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "books": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "description": "Id of the book."},
+                        **ENRICHMENT_FUNCTION["parameters"]["properties"],
+                    },
+                    "required": ["id"] + ENRICHMENT_FUNCTION["parameters"]["required"],
+                },
+            }
+        },
+        "required": ["books"],
+    },
+}
+
+
+def estimate_tokens(text):
+    """
+    Cheap token count estimate (about four characters per token for English text).
+    """
+    return len(text) // 4 + 1
 
 
 class LLMGraphEnrichment:
-    def __init__(self, neo4j_uri, neo4j_user, neo4j_password, openai_api_key):
+    # Bump to re-enrich books processed by an older version of the LLM stage
+    PIPELINE_VERSION = 1
+
+    def __init__(
+        self,
+        neo4j_uri,
+        neo4j_user,
+        neo4j_password,
+        openai_api_key,
+        openai_base_url=None,
+        model="gpt-3.5-turbo",
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries=5,
+        cache=None,
+        title_resolver=None,
+    ):
         """
         Initialize the class with Neo4j connection details and OpenAI API key.
+        openai_base_url points the client at any OpenAI-compatible server, the rate limits
+        are shared by every thread of the concurrent mode. Answers are looked up in and
+        stored to the optional ResponseCache, a read-only cache never calls the API.
+        Suggested similar titles are resolved to books with title_resolver (a
+        TitleResolver or the path of a saved one), built from the graph when not given.
         """
         self.db = Neo4jConnector(neo4j_uri, neo4j_user, neo4j_password)
-        self.client = OpenAI(api_key=openai_api_key)
+        # retries are handled by complete() so they go through the rate limiter
+        self.client = OpenAI(
+            api_key=openai_api_key, base_url=openai_base_url, max_retries=0
+        )
+        self.model = model
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.cache = cache
+        self.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.usage_lock = threading.Lock()
+        self.title_resolver = title_resolver
 
-    def get_description_from_llm(self, title, author):
+    def complete(self, prompt, function=None):
         """
-        Use an LLM to get the description of a book based on the title and author.
+        Send a prompt to the LLM and return the text of its answer, or the JSON arguments
+        of its call when the model is forced to call function.
+        Rate limits (429), server errors (5xx), timeouts and connection errors are retried
+        with exponential backoff, other errors are raised immediately.
         """
-        prompt = f"""
-            Provide a concise description for the book titled "{title}" by "{author}".
-            If you do not recognize the book or cannot provide a description, respond with "none".
-            """
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}]
-            )
-            result = response.choices[0].message["content"].strip()
-            if result.lower() == "none":
-                return None
-            return result
-        except Exception as e:
-            print(f"Error querying LLM for description: {e}")
-            return None
+        request = {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
+        key_parts = [self.model, prompt]
+        if function is not None:
+            request["tools"] = [{"type": "function", "function": function}]
+            request["tool_choice"] = {
+                "type": "function",
+                "function": {"name": function["name"]},
+            }
+            key_parts.append(json.dumps(function, sort_keys=True))
 
-    def add_description_to_book(self, book_id, title, author):
+        if self.cache is not None:
+            key = self.cache.make_key(*key_parts)
+            cached = self.cache.get(key)
+            metrics.inc("llm_cache_lookups_total", result="hit" if cached else "miss")
+            if cached is not None:
+                return cached
+            if self.cache.read_only:
+                raise CacheMissError("LLM response not cached (read-only cache).")
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(estimate_tokens(prompt) + COMPLETION_TOKEN_ESTIMATE)
+            try:
+                with metrics.timer("openai_request_seconds", model=self.model):
+                    response = self.client.chat.completions.create(**request)
+                metrics.inc("openai_requests_total", outcome="ok")
+                if response.usage is not None:
+                    with self.usage_lock:
+                        self.usage["requests"] += 1
+                        self.usage["prompt_tokens"] += response.usage.prompt_tokens
+                        self.usage["completion_tokens"] += response.usage.completion_tokens
+                message = response.choices[0].message
+                if function is not None:
+                    if not message.tool_calls:
+                        raise ValueError("LLM answered without calling the function.")
+                    result = message.tool_calls[0].function.arguments
+                else:
+                    result = message.content.strip()
+                if self.cache is not None:
+                    self.cache.set(key, result)
+                return result
+            except (RateLimitError, APIConnectionError) as e:
+                error = e
+            except APIStatusError as e:
+                if e.status_code < 500:
+                    raise
+                error = e
+            if attempt == self.max_retries:
+                metrics.inc("openai_requests_total", outcome="error")
+                raise error
+            metrics.inc("openai_requests_total", outcome="retry")
+            delay = backoff_delay(attempt)
+            logger.warning(f"LLM request failed ({error}), retrying in {delay:.1f}s.")
+            time.sleep(delay)
+
+    def description_prompt(self, title, author):
         """
-        Add the description attribute to a book node in the graph if not already available.
+        Build the prompt asking for the description of a book.
         """
-        try:
-            # Check if the book already has a description
-            result = self.db.run_query(
-                "MATCH (b:Book {id: $book_id}) RETURN b.description AS description",
-                {"book_id": book_id},
-                single=True,
-            )
-            if result and result.get("description"):
-                print(f"Book '{title}' already has a description.")
-                return False  # Description already exists
-
-            # Fetch description from the LLM
-            description = self.get_description_from_llm(title, author)
-            if not description:
-                print(f"No description found for '{title}' by '{author}'.")
-                return False
-
-            # Update the book node with the description
-            self.db.run_query(
-                "MATCH (b:Book {id: $book_id}) SET b.description = $description",
-                {"book_id": book_id, "description": description},
-            )
-            print(f"Added description to '{title}'.")
-            return True  # Description added
-        except Exception as e:
-            print(f"Error adding description to book: {e}")
-            return False
+        return f"""
+            Provide a concise description for the book titled "{title}" by "{author}".
+            If you do not recognize the book or cannot provide a description, respond with "none".
+            """
 
-    def add_attributes_from_llm(self, book_id, title, author, description):
+    def attributes_prompt(self, title, author, description):
         """
-        Use the LLM to extract attributes (e.g., genre) and add them to the graph.
+        Build the prompt asking for the genre, themes and audience of a book.
         """
-        if not description or description.strip() == "":
-            print(f"Skipping attributes for '{title}' as description is not available.")
-            return
-
-        prompt = f"""
+        return f"""
             Analyze the following description of a book titled "{title}" by "{author}":
             "{description}"
             Extract the genre, themes, and target audience of the book. Provide them in the format:
@@ -78,148 +197,571 @@ class LLMGraphEnrichment:
             If you cannot determine any of these attributes, use "unknown".
             """
 
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}]
-            )
-            result = response.choices[0].message["content"].strip()
-            attributes = {
-                "genre": "unknown",
-                "themes": "unknown",
-                "audience": "unknown",
-            }
-
-            # Parse the response for attributes
-            for line in result.split("\n"):
-                if "Genre:" in line:
-                    attributes["genre"] = line.replace("Genre:", "").strip()
-                elif "Themes:" in line:
-                    attributes["themes"] = line.replace("Themes:", "").strip()
-                elif "Audience:" in line:
-                    attributes["audience"] = line.replace("Audience:", "").strip()
-
-            # Add attributes to the book node
-            self.db.run_query(
-                """
-                MATCH (b:Book {id: $book_id})
-                SET b.genre = $genre, b.themes = $themes, b.audience = $audience
-                """,
-                {
-                    "book_id": book_id,
-                    "genre": attributes["genre"],
-                    "themes": attributes["themes"],
-                    "audience": attributes["audience"],
-                },
-            )
-            print(f"Added attributes to '{title}': {attributes}.")
-        except Exception as e:
-            print(f"Error adding attributes to book: {e}")
-
-    def add_similarity_relationships(self, book_id, title, description):
+    def similarity_prompt(self, title, description):
         """
-        Use the description to find similar books and add SIMILAR_TO relationships.
+        Build the prompt asking for books similar to a book.
         """
         if not description or description.strip() == "":
-            prompt = f"""
+            return f"""
             Given the book title "{title}", suggest up to 3 similar books.
             If you do not recognize the book or cannot find similar ones, respond with "none".
             Provide only the titles of similar books as a comma-separated list or "none".
             """
-        else:
-            prompt = f"""
+        return f"""
                 Based on the following description of the book titled "{title}":
                 "{description}"
                 Suggest up to 3 similar books. Provide only the titles of similar books as a comma-separated list.
                 If you cannot find similar books, respond with "none".
                 """
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo", messages=[{"role": "user", "content": prompt}]
+
+    def combined_prompt(self, title, author, description):
+        """
+        Build the prompt asking for the description, attributes and similar books of a
+        book at once, answered through ENRICHMENT_FUNCTION.
+        """
+        if description and description.strip() != "":
+            return f"""
+            Analyze the following description of a book titled "{title}" by "{author}":
+            "{description}"
+            Call record_book_enrichment with a null description, the genre, themes and target
+            audience of the book ("unknown" when they cannot be determined) and the titles of
+            up to 3 similar books (an empty list if you cannot find any).
+            """
+        return f"""
+            Consider the book titled "{title}" by "{author}".
+            Call record_book_enrichment with a concise description of the book (null if you do
+            not recognize it), its genre, themes and target audience ("unknown" when they
+            cannot be determined) and the titles of up to 3 similar books (an empty list if
+            you cannot find any).
+            """
+
+    def validate_enrichment(self, arguments):
+        """
+        Validate the JSON arguments of a record_book_enrichment call and normalize them.
+        "none"/"unknown" answers become None so they never overwrite graph properties.
+        Raises ValueError when the arguments do not match ENRICHMENT_FUNCTION.
+        """
+        data = json.loads(arguments)
+        if not isinstance(data, dict):
+            raise ValueError("Enrichment is not a JSON object.")
+        missing = set(ENRICHMENT_FUNCTION["parameters"]["required"]) - set(data)
+        if missing:
+            raise ValueError(f"Enrichment is missing {sorted(missing)}.")
+
+        result = {}
+        for field in ("description", "genre", "themes", "audience"):
+            value = data[field]
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"Enrichment field '{field}' is not a string.")
+            if value is not None:
+                value = value.strip()
+            result[field] = (
+                None if not value or value.lower() in ("none", "unknown") else value
+            )
+
+        similar_books = data["similar_books"]
+        if not isinstance(similar_books, list) or not all(
+            isinstance(similar_title, str) for similar_title in similar_books
+        ):
+            raise ValueError("Enrichment field 'similar_books' is not a list of strings.")
+        result["similar"] = [
+            similar_title.strip() for similar_title in similar_books if similar_title.strip()
+        ][:3]
+        return result
+
+    def packed_prompt(self, books):
+        """
+        Build the prompt asking for the enrichment of several books at once, answered
+        through PACKED_ENRICHMENT_FUNCTION with one item per book id.
+        """
+        lines = "\n".join(
+            json.dumps(
+                {
+                    "id": book["id"],
+                    "title": book["name"],
+                    "author": book["author"],
+                    "description": book.get("description") or None,
+                }
+            )
+            for book in books
+        )
+        return f"""
+            For each of the following books (one JSON object per line):
+            {lines}
+            Call record_books_enrichment with one item per book, using the same id. For each
+            book give a concise description (null if the book already has a description or
+            you do not recognize it), its genre, themes and target audience ("unknown" when
+            they cannot be determined) and the titles of up to 3 similar books (an empty list
+            if you cannot find any).
+            """
+
+    def pack_books(self, books, books_per_request, token_budget):
+        """
+        Group books into packs of at most books_per_request books whose estimated prompt
+        and completion tokens stay within token_budget (a single book is always allowed).
+        """
+        overhead = estimate_tokens(self.packed_prompt([]))
+        pack = []
+        pack_tokens = overhead
+        for book in books:
+            book_tokens = (
+                estimate_tokens(book["name"] + book["author"] + (book.get("description") or ""))
+                + COMPLETION_TOKEN_ESTIMATE
             )
-            result = response.choices[0].message["content"].strip()
-            if result.lower() == "none":
-                print(f"No similar books found for '{title}'.")
-                return
-
-            similar_books = [book.strip() for book in result.split(",") if book.strip()]
-            for similar_title in similar_books:
-                # Check if the similar book exists in the graph
-                result = self.db.run_query(
-                    "MATCH (b:Book {name: $title}) RETURN b.id AS id",
-                    {"title": similar_title},
+            if pack and (
+                len(pack) >= books_per_request or pack_tokens + book_tokens > token_budget
+            ):
+                yield pack
+                pack = []
+                pack_tokens = overhead
+            pack.append(book)
+            pack_tokens += book_tokens
+        if pack:
+            yield pack
+
+    def parse_attributes(self, result):
+        """
+        Parse the genre, themes and audience out of an answer to attributes_prompt.
+        """
+        attributes = {
+            "genre": "unknown",
+            "themes": "unknown",
+            "audience": "unknown",
+        }
+        for line in result.split("\n"):
+            if "Genre:" in line:
+                attributes["genre"] = line.replace("Genre:", "").strip()
+            elif "Themes:" in line:
+                attributes["themes"] = line.replace("Themes:", "").strip()
+            elif "Audience:" in line:
+                attributes["audience"] = line.replace("Audience:", "").strip()
+        return attributes
+
+    def parse_similar_titles(self, result):
+        """
+        Parse the titles out of an answer to similarity_prompt.
+        """
+        if result.lower() == "none":
+            return []
+        return [book.strip() for book in result.split(",") if book.strip()]
+
+    def get_description_from_llm(self, title, author):
+        """
+        Use an LLM to get the description of a book based on the title and author.
+        LLM errors are raised to the caller.
+        """
+        result = self.complete(self.description_prompt(title, author))
+        if result.lower() == "none":
+            return None
+        return result
+
+    def add_description_to_book(self, book_id, title, author):
+        """
+        Add the description attribute to a book node in the graph if not already available.
+        LLM and database errors are raised to the caller.
+        """
+        # Check if the book already has a description
+        result = self.db.run_query(
+            "MATCH (b:Book {id: $book_id}) RETURN b.description AS description",
+            {"book_id": book_id},
+            single=True,
+        )
+        if result and result.get("description"):
+            logger.debug(f"Book '{title}' already has a description.")
+            return False  # Description already exists
+
+        # Fetch description from the LLM
+        description = self.get_description_from_llm(title, author)
+        if not description:
+            logger.debug(f"No description found for '{title}' by '{author}'.")
+            return False
+
+        # Update the book node with the description
+        self.db.run_query(
+            "MATCH (b:Book {id: $book_id}) SET b.description = $description",
+            {"book_id": book_id, "description": description},
+        )
+        logger.debug(f"Added description to '{title}'.")
+        return True  # Description added
+
+    def add_attributes_from_llm(self, book_id, title, author, description):
+        """
+        Use the LLM to extract attributes (e.g., genre) and add them to the graph.
+        LLM and database errors are raised to the caller.
+        """
+        if not description or description.strip() == "":
+            logger.debug(f"Skipping attributes for '{title}' as description is not available.")
+            return
+
+        attributes = self.parse_attributes(
+            self.complete(self.attributes_prompt(title, author, description))
+        )
+
+        # Add attributes to the book node
+        self.db.run_query(
+            """
+            MATCH (b:Book {id: $book_id})
+            SET b.genre = $genre, b.themes = $themes, b.audience = $audience
+            """,
+            {
+                "book_id": book_id,
+                "genre": attributes["genre"],
+                "themes": attributes["themes"],
+                "audience": attributes["audience"],
+            },
+        )
+        logger.debug(f"Added attributes to '{title}': {attributes}.")
+
+    def add_similarity_relationships(self, book_id, title, description):
+        """
+        Use the description to find similar books and add SIMILAR_TO relationships.
+        LLM and database errors are raised to the caller.
+        """
+        similar_books = self.parse_similar_titles(
+            self.complete(self.similarity_prompt(title, description))
+        )
+        if not similar_books:
+            logger.debug(f"No similar books found for '{title}'.")
+            return
+
+        for similar_title in similar_books:
+            # Check if the similar book exists in the graph
+            similar_ids = self.title_index().resolve_ids(similar_title)
+
+            if similar_ids and similar_ids[0] != book_id:
+                similar_book_id = similar_ids[0]
+
+                # Add the similarity relationship if it doesn't already exist
+                relationship_check = self.db.run_query(
+                    """
+                    MATCH (b1:Book {id: $book_id})-[r:SIMILAR_TO]->(b2:Book {id: $similar_book_id})
+                    RETURN r
+                    """,
+                    {"book_id": book_id, "similar_book_id": similar_book_id},
                     single=True,
                 )
 
-                if result:
-                    similar_book_id = result["id"]
-
-                    # Add the similarity relationship if it doesn't already exist
-                    relationship_check = self.db.run_query(
+                if not relationship_check:
+                    self.db.run_query(
                         """
-                        MATCH (b1:Book {id: $book_id})-[r:SIMILAR_TO]->(b2:Book {id: $similar_book_id})
-                        RETURN r
+                        MATCH (b1:Book {id: $book_id}), (b2:Book {id: $similar_book_id})
+                        MERGE (b1)-[:SIMILAR_TO]->(b2)
                         """,
                         {"book_id": book_id, "similar_book_id": similar_book_id},
-                        single=True,
                     )
-
-                    if not relationship_check:
-                        self.db.run_query(
-                            """
-                            MATCH (b1:Book {id: $book_id}), (b2:Book {id: $similar_book_id})
-                            MERGE (b1)-[:SIMILAR_TO]->(b2)
-                            """,
-                            {"book_id": book_id, "similar_book_id": similar_book_id},
-                        )
-                        print(
-                            f"Added SIMILAR_TO relationship between '{title}' and '{similar_title}'."
-                        )
-                    else:
-                        print(
-                            f"SIMILAR_TO relationship already exists between '{title}' and '{similar_title}'."
-                        )
+                    logger.debug(
+                        f"Added SIMILAR_TO relationship between '{title}' and '{similar_title}'."
+                    )
                 else:
-                    print(f"'{similar_title}' not found in the graph. Skipping.")
-        except Exception as e:
-            print(f"Error adding similarity relationships: {e}")
+                    logger.debug(
+                        f"SIMILAR_TO relationship already exists between '{title}' and '{similar_title}'."
+                    )
+            else:
+                logger.debug(f"'{similar_title}' not found in the graph. Skipping.")
 
-    def enrich_with_LLM(self):
+    def title_index(self):
         """
-        Iterate through all books in the graph and enrich them with descriptions, attributes, and relationships.
+        Return the TitleResolver of the books, loading or building it on first use.
+        """
+        if not isinstance(self.title_resolver, TitleResolver):
+            path = self.title_resolver
+            if path is not None and os.path.exists(path):
+                self.title_resolver = TitleResolver.load(path)
+            else:
+                self.title_resolver = TitleResolver.from_graph(self.db)
+                if path is not None:
+                    self.title_resolver.save(path)
+        return self.title_resolver
+
+    def resolve_similar(self, titles):
+        """
+        Ids of the books matching the suggested similar titles.
+        """
+        ids = []
+        for title in titles:
+            for book_id in self.title_index().resolve_ids(title):
+                if book_id not in ids:
+                    ids.append(book_id)
+        return ids
+
+    def iter_unprocessed_books(self, page_size=1000):
+        """
+        Iterate over the books that have not been enriched by the current PIPELINE_VERSION
+        of the LLM stage, using keyset pagination on Book.id so that memory stays flat and
+        a restarted run resumes where the previous one stopped.
+        """
+        return self.db.iter_keyset(
+            """
+            MATCH (b:Book)
+            WHERE b.id > $last_key
+              AND (b.llm_pipeline_version IS NULL OR b.llm_pipeline_version < $version)
+            WITH b ORDER BY b.id LIMIT $page_size
+            OPTIONAL MATCH (b)-[:`WRITTEN_BY`]->(a:Author)
+            WITH b, collect(a.name) AS authors
+            RETURN b.id AS id, b.name AS name,
+                   coalesce(authors[0], "Unknown Author") AS author,
+                   b.description AS description
+            ORDER BY id
+            """,
+            {"version": self.PIPELINE_VERSION},
+            page_size=page_size,
+        )
+
+    def count_unprocessed_books(self):
+        """
+        Number of books the LLM stage still has to enrich, for progress reporting.
         """
-        books = self.db.run_query(
+        record = self.db.run_query(
             """
-            MATCH (b:Book)-[:`WRITTEN_BY`]->(a:Author)
-            RETURN b.id AS id, b.name AS name, a.name AS author, b.description AS description
+            MATCH (b:Book)
+            WHERE b.llm_pipeline_version IS NULL OR b.llm_pipeline_version < $version
+            RETURN count(b) AS count
+            """,
+            {"version": self.PIPELINE_VERSION},
+            single=True,
+        )
+        return record["count"] if record else None
+
+    def mark_books_enriched(self, book_ids):
+        """
+        Record that the LLM stage of the current PIPELINE_VERSION processed these books.
+        """
+        self.db.run_query(
             """
+            UNWIND $ids AS id
+            MATCH (b:Book {id: id})
+            SET b.llm_enriched_at = datetime(), b.llm_pipeline_version = $version
+            """,
+            {"ids": book_ids, "version": self.PIPELINE_VERSION},
+        )
+
+    def enrich_with_LLM(self, page_size=1000):
+        """
+        Iterate through all books in the graph and enrich them with descriptions, attributes, and relationships.
+        Books already enriched by the current PIPELINE_VERSION are skipped. A book is only
+        marked as enriched when all its LLM calls succeeded, so failed books are retried
+        by the next run.
+        """
+        enriched = 0
+        failed = 0
+        # reuse one session for the many small queries of each book
+        with self.db.session():
+            for book in self.iter_unprocessed_books(page_size):
+                book_id = book["id"]
+                title = book["name"]
+                author = book["author"]
+                description = book.get("description")
+
+                logger.debug(f"Processing book: '{title}' by '{author}'...")
+
+                try:
+                    result = None  # Initialize result
+                    # Add description if missing
+                    if not description:
+                        if self.add_description_to_book(book_id, title, author):
+                            # Fetch updated description
+                            result = self.db.run_query(
+                                "MATCH (b:Book {id: $book_id}) RETURN b.description AS description",
+                                {"book_id": book_id},
+                                single=True,
+                            )
+                        description = result["description"] if result else None
+
+                    # Add attributes and relationships
+                    self.add_attributes_from_llm(book_id, title, author, description)
+                    self.add_similarity_relationships(book_id, title, description)
+                except Exception as e:
+                    # left unmarked, the next run retries the book
+                    failed += 1
+                    logger.error(f"Error enriching book '{title}': {e}")
+                    continue
+                self.mark_books_enriched([book_id])
+                enriched += 1
+        metrics.inc("llm_books_total", enriched, outcome="enriched")
+        metrics.inc("llm_books_total", failed, outcome="failed")
+        logger.info(f"LLM enrichment: {enriched} books enriched, {failed} failed.")
+
+    def generate_enrichment(self, book):
+        """
+        Ask the LLM for the missing description, the attributes and the similar titles of
+        a book without touching the graph. LLM errors are raised to the caller.
+
+        :param book: Dictionary with the id, name, author and description of the book.
+        :return: Row for write_enrichment_batch.
+        """
+        title = book["name"]
+        description = book.get("description")
+        new_description = None
+        if not description:
+            result = self.complete(self.description_prompt(title, book["author"]))
+            if result.lower() != "none":
+                new_description = description = result
+
+        attributes = {"genre": None, "themes": None, "audience": None}
+        if description and description.strip() != "":
+            attributes = self.parse_attributes(
+                self.complete(
+                    self.attributes_prompt(title, book["author"], description)
+                )
+            )
+
+        similar_titles = self.parse_similar_titles(
+            self.complete(self.similarity_prompt(title, description))
+        )
+        return {
+            "id": book["id"],
+            "description": new_description,
+            "similar": similar_titles,
+            **attributes,
+        }
+
+    def generate_combined_enrichment(self, book):
+        """
+        Same as generate_enrichment with a single function-calling request per book.
+        Malformed answers raise ValueError instead of being stored.
+        """
+        description = book.get("description")
+        enrichment = self.validate_enrichment(
+            self.complete(
+                self.combined_prompt(book["name"], book["author"], description),
+                function=ENRICHMENT_FUNCTION,
+            )
         )
+        if description:
+            # never replace a description that came with the data
+            enrichment["description"] = None
+        return {"id": book["id"], **enrichment}
 
+    def generate_packed_enrichment(self, books):
+        """
+        Enrich a pack of books with a single request. Books missing from the answer or
+        with a malformed item fall back to generate_combined_enrichment one by one.
+
+        :return: Rows for write_enrichment_batch, books that failed entirely are left out.
+        """
+        items = {}
+        try:
+            answer = json.loads(
+                self.complete(self.packed_prompt(books), function=PACKED_ENRICHMENT_FUNCTION)
+            )
+            for item in answer.get("books", []):
+                if isinstance(item, dict) and "id" in item:
+                    items[str(item.pop("id"))] = item
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Malformed answer for a pack of {len(books)} books: {e}")
+
+        rows = []
         for book in books:
-            book_id = book["id"]
-            title = book["name"]
-            author = book["author"]
-            description = book.get("description")
-
-            print(f"Processing book: '{title}' by '{author}'...")
-
-            result = None  # Initialize result
-            # Add description if missing
-            if not description:
-                if self.add_description_to_book(book_id, title, author):
-                    # Fetch updated description
-                    result = self.db.run_query(
-                        "MATCH (b:Book {id: $book_id}) RETURN b.description AS description",
-                        {"book_id": book_id},
-                        single=True,
-                    )
-                description = result["description"] if result else None
+            try:
+                if book["id"] not in items:
+                    raise ValueError("missing from the packed answer")
+                enrichment = self.validate_enrichment(json.dumps(items[book["id"]]))
+                if book.get("description"):
+                    enrichment["description"] = None
+                rows.append({"id": book["id"], **enrichment})
+            except ValueError as e:
+                logger.warning(f"Falling back to a single request for '{book['name']}': {e}")
+                try:
+                    rows.append(self.generate_combined_enrichment(book))
+                except Exception as e:
+                    logger.error(f"Error enriching book '{book['name']}': {e}")
+        return rows
+
+    def write_enrichment_batch(self, rows):
+        """
+        Write the descriptions, attributes and SIMILAR_TO relationships of a batch of
+        books produced by generate_enrichment with a single UNWIND query, and mark the
+        books as enriched by the current PIPELINE_VERSION. Similar titles are resolved
+        to Book ids beforehand.
+        """
+        rows = [{**row, "similar": self.resolve_similar(row["similar"])} for row in rows]
+        self.db.run_in_transaction(
+            [
+                (
+                    """
+                    UNWIND $rows AS row
+                    MATCH (b:Book {id: row.id})
+                    SET b.description = coalesce(b.description, row.description),
+                        b.genre = coalesce(row.genre, b.genre),
+                        b.themes = coalesce(row.themes, b.themes),
+                        b.audience = coalesce(row.audience, b.audience),
+                        b.llm_enriched_at = datetime(),
+                        b.llm_pipeline_version = $version
+                    WITH b, row
+                    UNWIND row.similar AS similar_id
+                    MATCH (s:Book {id: similar_id})
+                    WHERE s <> b
+                    MERGE (b)-[:SIMILAR_TO]->(s)
+                    """,
+                    {"rows": rows, "version": self.PIPELINE_VERSION},
+                )
+            ]
+        )
 
-            # Add attributes and relationships
-            self.add_attributes_from_llm(book_id, title, author, description)
-            self.add_similarity_relationships(book_id, title, description)
+    def enrich_with_LLM_concurrent(
+        self,
+        concurrency=8,
+        write_batch_size=100,
+        combined=False,
+        books_per_request=1,
+        token_budget=4000,
+        page_size=1000,
+    ):
+        """
+        Enrich every book like enrich_with_LLM, with the LLM requests of up to concurrency
+        books in flight at once and the results written back in batches of write_batch_size.
+        With combined, each book costs one structured request instead of three prompts.
+        With books_per_request above 1, up to that many books (within token_budget
+        estimated tokens) share one structured request.
+        Books are read page by page and only those not yet enriched by the current
+        PIPELINE_VERSION are processed, failed books are retried by the next run.
+        """
+        books = self.iter_unprocessed_books(page_size)
+        if books_per_request > 1:
+            packs = self.pack_books(books, books_per_request, token_budget)
+            generate = self.generate_packed_enrichment
+        else:
+            packs = ([book] for book in books)
+            generate_one = (
+                self.generate_combined_enrichment if combined else self.generate_enrichment
+            )
+
+            def generate(pack):
+                return [generate_one(pack[0])]
+
+        # the pages and the batched writes all run on this thread, they share a session
+        with self.db.session():
+            progress = ProgressReporter(
+                "LLM enrichment", total=self.count_unprocessed_books(), unit="books"
+            )
+            batch = []
+            enriched = 0
+            failed = 0
+            for pack, rows, error in map_bounded(generate, packs, concurrency):
+                if error is not None:
+                    failed += len(pack)
+                    logger.error(f"Error enriching book '{pack[0]['name']}': {error}")
+                    progress.update(len(pack), failed=failed)
+                    continue
+                failed += len(pack) - len(rows)
+                batch.extend(rows)
+                if len(batch) >= write_batch_size:
+                    self.write_enrichment_batch(batch)
+                    enriched += len(batch)
+                    batch = []
+                progress.update(len(pack), failed=failed)
+            if batch:
+                self.write_enrichment_batch(batch)
+                enriched += len(batch)
+        metrics.inc("llm_books_total", enriched, outcome="enriched")
+        metrics.inc("llm_books_total", failed, outcome="failed")
+        progress.finish(enriched=enriched, failed=failed, usage=self.usage)
 
     def close(self):
         """
-        Close the connection to the database.
+        Close the connection to the database and the response cache.
         """
         self.db.close()
+        if self.cache is not None:
+            logger.info(f"LLM cache: {self.cache.stats()}")
+            self.cache.close()
@@ -0,0 +1,626 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import random
+import re
+import resource
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from DBPedia_integration import DBpediaEnrichment
+from define_kg import GraphCreator
+from fake_openai_server import FakeOpenAIServer
+from fake_sparql_server import FakeSparqlServer
+from LLM_integration import LLMGraphEnrichment
+from metrics import metrics
+from neo4j_manager import Neo4jConnector
+from preprocess_data import DataProcessor
+from recommendation import RecommendationEngine
+from similarity_engine import SimilarityEngine
+
+STAGES = [
+    "process_books",
+    "process_ratings",
+    "generate_book_graph",
+    "add_ratings_to_graph",
+    "llm_enrichment",
+    "dbpedia_enrichment",
+    "similarity",
+    "recommendation",
+]
+
+PUBLISHERS = ["Penguin", "HarperCollins", "Tor Books", "Vintage", None]
+# Publishers of the shards after the first, past the 127 categories of int8 codes
+MANY_PUBLISHERS = PUBLISHERS + [f"Synthetic Publisher {i}" for i in range(300)]
+LANGUAGES = ["eng", "en-US", "fre", "spa", None]
+# Relationships created by the similarity stages, and the query counting them
+CREATED_RELATIONSHIP = re.compile(r"CREATE \(b\)-\[:(\w+)")
+RELATIONSHIP_COUNT = re.compile(r"MATCH \(b\)-\[r:(\w+)\]->\(s\)")
+# Properties a MERGE matches on, Neo4j rejects the statement when one of them is null
+MERGE_PROPERTIES = re.compile(r"MERGE [^\n]*?\{([^}]*)\}")
+ROW_FIELD = re.compile(r"row\.(\w+)")
+
+RATING_LABELS = [
+    "did not like it",
+    "it was ok",
+    "liked it",
+    "really liked it",
+    "it was amazing",
+]
+# Rating label of the real files without a numerical value
+NO_RATING = "This user doesn't have any rating"
+
+
+def book_title(book_id):
+    return f"Synthetic Book {book_id}"
+
+
+def author_name(author_id):
+    return f"Synthetic Author {author_id}"
+
+
+def generate_book_shards(directory, shards, books_per_shard, overlap=0.05, seed=0):
+    """
+    Write raw_data-like book shards with the columns DataProcessor expects, plus unused
+    ones. Consecutive shards share overlap of their ids, like the real overlapping shards.
+    The first shard has a handful of publishers, like the small real shard, and the
+    others a few hundred. Return the shard names and the number of distinct books.
+    """
+    rng = random.Random(seed)
+    names = []
+    step = int(books_per_shard * (1 - overlap))
+    for shard in range(shards):
+        name = f"book{shard}"
+        names.append(name)
+        publishers = PUBLISHERS if shard == 0 else MANY_PUBLISHERS
+        path = os.path.join(directory, f"{name}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(
+                [
+                    "Id",
+                    "Name",
+                    "Authors",
+                    "Rating",
+                    "pagesNumber",
+                    "PublishYear",
+                    "PublishMonth",
+                    "PublishDay",
+                    "Publisher",
+                    "Language",
+                    "Description",
+                    "CountsOfReview",
+                    "ISBN",
+                ]
+            )
+            for book_id in range(shard * step, shard * step + books_per_shard):
+                authors = [author_name(book_id % max(books_per_shard // 5, 1))]
+                if rng.random() < 0.1:
+                    authors.append(author_name(rng.randrange(books_per_shard)))
+                writer.writerow(
+                    [
+                        book_id,
+                        book_title(book_id),
+                        ";".join(authors),
+                        round(rng.uniform(1, 5), 2),
+                        rng.randrange(50, 1200),
+                        rng.randrange(1900, 2021),
+                        rng.randrange(1, 13),
+                        rng.randrange(1, 29),
+                        rng.choice(publishers) or "",
+                        rng.choice(LANGUAGES) or "",
+                        (
+                            f"A synthetic description of book {book_id}."
+                            if rng.random() < 0.5
+                            else ""
+                        ),
+                        rng.randrange(1000),
+                        f"{rng.randrange(10**9, 10**10)}",
+                    ]
+                )
+    return names, step * (shards - 1) + books_per_shard
+
+
+def generate_rating_shards(
+    directory, shards, ratings_per_shard, book_count, unknown=0.05, unrated=0.05, seed=0
+):
+    """
+    Write raw_data-like rating shards; unknown of the ratings are for titles that are
+    not in the books, unrated have the label without a numerical value, and a few
+    repeated header rows are mixed in as in the real files. Return the shard names.
+    """
+    rng = random.Random(seed + 1)
+    names = []
+    for shard in range(shards):
+        name = f"user_rating_{shard}"
+        names.append(name)
+        path = os.path.join(directory, f"{name}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["ID", "Name", "Rating"])
+            for i in range(ratings_per_shard):
+                if i % 1000 == 999:
+                    writer.writerow([rng.randrange(ratings_per_shard), "Rating", "Rating"])
+                    continue
+                if rng.random() < unknown:
+                    title = f"Unknown Book {rng.randrange(book_count)}"
+                else:
+                    title = book_title(rng.randrange(book_count))
+                label = NO_RATING if rng.random() < unrated else rng.choice(RATING_LABELS)
+                writer.writerow([rng.randrange(ratings_per_shard // 10 + 1), title, label])
+    return names
+
+
+def sparql_fixture(book_count, author_count, found=0.3):
+    """
+    Fixture of the fake SPARQL server where found of the books and authors are known.
+    """
+    every = max(int(1 / found), 1) if found else book_count + 1
+    books = {
+        book_title(book_id): {
+            "description": f"DBpedia abstract of book {book_id}.",
+            "genres": ["http://dbpedia.org/resource/Fantasy"],
+            "subjects": [f"http://dbpedia.org/resource/Category:Subject_{book_id % 50}"],
+            "adaptations": [],
+            "preceding": [book_title(book_id - 1)] if book_id else [],
+            "subsequent": [book_title(book_id + 1)],
+        }
+        for book_id in range(0, book_count, every)
+    }
+    persons = {
+        author_name(author_id): {
+            "biography": f"Synthetic Author {author_id} is a synthetic writer.",
+            "birthplace": "http://dbpedia.org/resource/Nowhere",
+        }
+        for author_id in range(0, author_count, every)
+    }
+    return {"books": books, "persons": persons}
+
+
+class RecordingConnector(Neo4jConnector):
+    def __init__(self, latency=0.0):
+        """
+        Stand-in for Neo4jConnector that records every statement instead of sending it,
+        waiting latency seconds per round trip. It keeps the books and authors written
+        by the loaders and answers the paging and count queries of the enrichment stages
+        from them, by recognizing their text. Like Neo4j, it rejects a MERGE on a null
+        property. Nothing else of Cypher is emulated.
+        """
+        self.latency = latency
+        self.fetch_size = 1000
+        self.calls = {}
+        self.rows = 0
+        self.books = {}
+        self.authors = set()
+        self.book_authors = {}
+        self.ratings = []
+        # relationship type -> (book id, other book id, score) of the created edges
+        self.relationships = {}
+
+    def close(self):
+        pass
+
+    @contextmanager
+    def session(self):
+        yield None
+
+    def record(self, operation, parameters):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        rows = (parameters or {}).get("rows")
+        self.rows += len(rows) if isinstance(rows, list) else 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def apply(self, query, parameters):
+        """
+        Keep the books, authors and ratings written by the loaders and the scored edges
+        between books created by the similarity stages.
+        """
+        rows = (parameters or {}).get("rows") or []
+        for properties in MERGE_PROPERTIES.findall(query):
+            for field in ROW_FIELD.findall(properties):
+                if any(isinstance(row, dict) and row.get(field) is None for row in rows):
+                    raise ValueError(
+                        f"Cannot merge because of null property value for '{field}'."
+                    )
+        created = CREATED_RELATIONSHIP.search(query)
+        if "MERGE (b:Book {id: row.id})" in query:
+            for row in rows:
+                self.books[str(row["id"])] = {
+                    "id": str(row["id"]),
+                    "name": row["name"],
+                    "description": row.get("description"),
+                }
+        elif "MERGE (a:Author {name: row.author_name})" in query:
+            for row in rows:
+                self.authors.add(row["author_name"])
+                self.book_authors.setdefault(str(row["book_id"]), row["author_name"])
+        elif "MERGE (u:User {id: row.user_id})" in query:
+            for row in rows:
+                self.ratings.extend(
+                    (row["user_id"], book_id, row["num_rating"]) for book_id in row["book_ids"]
+                )
+        elif created:
+            edges = self.relationships.setdefault(created.group(1), [])
+            # like MATCH, rows whose books do not exist create nothing
+            edges.extend(
+                (row["book_id"], row["similar_id"], row["score"])
+                for row in rows
+                if row["book_id"] in self.books and row["similar_id"] in self.books
+            )
+
+    def answer(self, query, parameters):
+        """
+        Records returned for the read queries of the pipeline.
+        """
+        parameters = parameters or {}
+        counted = RELATIONSHIP_COUNT.search(query)
+        if counted:
+            edges = self.relationships.get(counted.group(1), [])
+            invalid = sum(
+                1 for book_id, similar_id, score in edges
+                if book_id == similar_id or not 0 < score <= 1.0001
+            )
+            return [{"count": len(edges), "invalid": invalid}]
+        if "count(" in query:
+            label_authors = "MATCH (n:Author)" in query
+            return [{"count": len(self.authors if label_authors else self.books)}]
+        if "$last_key" in query:
+            last_key, page_size = parameters["last_key"], parameters["page_size"]
+            # the book queries also match (a:Author), but only to collect the authors
+            if "MATCH (a:Author)" in query and "a.name > $last_key" in query:
+                names = sorted(name for name in self.authors if name > last_key)
+                return [{"name": name} for name in names[:page_size]]
+            ids = sorted(book_id for book_id in self.books if book_id > last_key)
+            return [
+                {
+                    **self.books[book_id],
+                    "author": self.book_authors.get(book_id, "Unknown Author"),
+                    "authors": [self.book_authors[book_id]]
+                    if book_id in self.book_authors
+                    else [],
+                }
+                for book_id in ids[:page_size]
+            ]
+        if "[r:REVIEWED_BY]->(u:User)" in query:
+            return [
+                {"user_id": user_id, "book_id": book_id, "rating": rating}
+                for user_id, book_id, rating in self.ratings
+                if rating is not None
+            ]
+        if "RETURN b.name AS name, b.id AS id" in query:
+            return [{"name": book["name"], "id": book["id"]} for book in self.books.values()]
+        return []
+
+    def run_in_transaction(self, statements, write=True):
+        with metrics.timer("cypher_seconds", operation="transaction"):
+            self.record("transaction", None)
+            results = []
+            for query, parameters in statements:
+                self.rows += len((parameters or {}).get("rows") or [])
+                self.apply(query, parameters)
+                results.append(self.answer(query, parameters) if not write else [])
+            return results
+
+    def run_many(self, query, rows, batch_size=1000):
+        rows = list(rows)
+        for i in range(0, len(rows), batch_size):
+            with metrics.timer("cypher_seconds", operation="run_many"):
+                parameters = {"rows": rows[i : i + batch_size]}
+                self.record("run_many", parameters)
+                self.apply(query, parameters)
+        return len(rows)
+
+    def run_query(self, query, parameters=None, single=False):
+        with metrics.timer("cypher_seconds", operation="query"):
+            self.record("query", parameters)
+            self.apply(query, parameters)
+            records = self.answer(query, parameters)
+        if single:
+            return records[0] if records else None
+        return records
+
+    def run_auto_commit(self, query, parameters=None):
+        with metrics.timer("cypher_seconds", operation="auto_commit"):
+            self.record("auto_commit", parameters)
+        return {}
+
+    def stream_query(self, query, parameters=None, fetch_size=None):
+        self.record("stream", parameters)
+        yield from self.answer(query, parameters)
+
+    def explain(self, query, parameters=None):
+        self.record("explain", parameters)
+        return {"operatorType": "ProduceResults", "arguments": {}, "children": []}
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process and of its (process pool) children, in MiB.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class PipelineBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        self.db = None
+
+    def connector(self):
+        """
+        The shared connector of the graph stages: a real Neo4j if one was given (the
+        database is wiped), otherwise a RecordingConnector.
+        """
+        if self.db is None:
+            if self.args.neo4j_uri:
+                self.db = Neo4jConnector(
+                    self.args.neo4j_uri, self.args.neo4j_user, self.args.neo4j_password
+                )
+            else:
+                self.db = RecordingConnector(latency=self.args.neo4j_latency)
+        return self.db
+
+    def check_relationships(self, stage, rel_type):
+        """
+        Fail the run if stage wrote no rel_type relationship between books, or one from
+        a book to itself or with a score outside (0, 1].
+        """
+        record = self.connector().run_query(
+            f"""
+            MATCH (b)-[r:{rel_type}]->(s)
+            WHERE r.score IS NOT NULL
+            RETURN count(r) AS count,
+                   sum(CASE WHEN b = s OR NOT 0 < r.score <= 1.0001 THEN 1 ELSE 0 END)
+                       AS invalid
+            """,
+            single=True,
+        )
+        if not record or not record["count"]:
+            raise RuntimeError(f"The {stage} stage wrote no {rel_type} relationship.")
+        if record["invalid"]:
+            raise RuntimeError(
+                f"The {stage} stage wrote {record['invalid']} invalid {rel_type} "
+                f"relationships out of {record['count']}."
+            )
+        print(f"{'':>22} {record['count']} {rel_type} relationships written")
+
+    def run_stage(self, name, count, function):
+        """
+        Run a stage, then record its duration, throughput, latencies and peak RSS.
+        """
+        metrics.reset()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        summary = metrics.to_dict()
+        latencies = {
+            "/".join([histogram["name"], *histogram["labels"].values()]): {
+                "count": histogram["count"],
+                "p50": histogram["p50"],
+                "p95": histogram["p95"],
+            }
+            for histogram in summary["histograms"]
+        }
+        own_rss, children_rss = peak_rss_mb()
+        self.results.append(
+            {
+                "stage": name,
+                "seconds": elapsed,
+                "items": count,
+                "items_per_second": count / elapsed if elapsed else 0.0,
+                "latencies": latencies,
+                "counters": summary["counters"],
+                "peak_rss_mb": own_rss,
+                "peak_children_rss_mb": children_rss,
+            }
+        )
+        print(
+            f"{name:>22} {elapsed:>9.2f}s {count:>10} items "
+            f"{count / elapsed if elapsed else 0:>10.0f}/s  peak RSS {own_rss:.0f} MiB "
+            f"(children {children_rss:.0f} MiB)"
+        )
+
+    def run(self):
+        args = self.args
+        stages = args.stages or STAGES
+        book_shards, book_count = generate_book_shards(
+            "raw_data", args.book_shards, args.books_per_shard, seed=args.seed
+        )
+        rating_shards = generate_rating_shards(
+            "raw_data", args.rating_shards, args.ratings_per_shard, book_count, seed=args.seed
+        )
+        if "process_books" in stages:
+            processor = DataProcessor(fileoutput="bench_books")
+            processor.reset_data()
+            self.run_stage(
+                "process_books",
+                args.book_shards * args.books_per_shard,
+                lambda: processor.process_books_parallel(book_shards, workers=args.workers),
+            )
+        if "process_ratings" in stages:
+            processor = DataProcessor(fileoutput="bench_ratings")
+            processor.reset_data()
+            self.run_stage(
+                "process_ratings",
+                args.rating_shards * args.ratings_per_shard,
+                lambda: processor.process_ratings_parallel(rating_shards, workers=args.workers),
+            )
+
+        graph_creator = GraphCreator()
+        graph_creator.db = self.connector()
+        if "generate_book_graph" in stages:
+            self.run_stage(
+                "generate_book_graph",
+                book_count,
+                lambda: graph_creator.generate_book_graph("bench_books", batch_size=10000),
+            )
+        if "add_ratings_to_graph" in stages:
+            self.run_stage(
+                "add_ratings_to_graph",
+                args.rating_shards * args.ratings_per_shard,
+                lambda: graph_creator.add_ratings_to_graph(
+                    "bench_ratings", batch_size=10000, books_filename="bench_books"
+                ),
+            )
+
+        if "llm_enrichment" in stages:
+            fake_openai = FakeOpenAIServer(
+                latency=args.openai_latency, jitter=args.openai_latency / 4
+            )
+            enrichment = LLMGraphEnrichment(
+                "neo4j://localhost:7687",
+                "neo4j",
+                "neo4j",
+                "fake-key",
+                openai_base_url=fake_openai.start(),
+            )
+            enrichment.db = self.connector()
+            try:
+                self.run_stage(
+                    "llm_enrichment",
+                    enrichment.count_unprocessed_books() or 0,
+                    lambda: enrichment.enrich_with_LLM_concurrent(
+                        concurrency=args.concurrency,
+                        write_batch_size=100,
+                        combined=True,
+                        books_per_request=args.books_per_request,
+                    ),
+                )
+            finally:
+                fake_openai.stop()
+
+        if "dbpedia_enrichment" in stages:
+            fake_sparql = FakeSparqlServer(
+                sparql_fixture(book_count, max(args.books_per_shard // 5, 1)),
+                latency=args.sparql_latency,
+            )
+            enrichment = DBpediaEnrichment(
+                "neo4j://localhost:7687",
+                "neo4j",
+                "neo4j",
+                dbpedia_endpoint=fake_sparql.start(),
+                max_workers=args.concurrency,
+                requests_per_minute=None,
+            )
+            enrichment.db = self.connector()
+            try:
+                self.run_stage(
+                    "dbpedia_enrichment",
+                    (enrichment.count_unprocessed("Book") or 0)
+                    + (enrichment.count_unprocessed("Author") or 0),
+                    lambda: enrichment.enrich_graph_with_dbpedia_batched(batch_size=50),
+                )
+            finally:
+                fake_sparql.stop()
+
+        if "similarity" in stages:
+            engine = SimilarityEngine(
+                "neo4j://localhost:7687",
+                "neo4j",
+                "neo4j",
+                lsh_tables=args.lsh_tables,
+            )
+            engine.db = self.connector()
+            self.run_stage("similarity", book_count, engine.build_similarity_graph)
+            self.check_relationships("similarity", "SIMILAR_TO")
+
+        if "recommendation" in stages:
+            engine = RecommendationEngine(
+                "neo4j://localhost:7687", "neo4j", "neo4j", workers=args.workers
+            )
+            engine.db = self.connector()
+
+            def recommend():
+                engine.build()
+                engine.write_similar_edges()
+                for user_id in engine.user_ids[: args.recommendations]:
+                    engine.recommend(user_id, 10)
+
+            self.run_stage(
+                "recommendation", args.rating_shards * args.ratings_per_shard, recommend
+            )
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark every pipeline stage on synthetic Goodreads-like shards, "
+        "against a recording fake Neo4j (or a real one) and fake OpenAI/SPARQL servers."
+    )
+    parser.add_argument("--book-shards", type=int, default=4)
+    parser.add_argument("--books-per-shard", type=int, default=5000)
+    parser.add_argument("--rating-shards", type=int, default=2)
+    parser.add_argument("--ratings-per-shard", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=None, help="preprocessing processes")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="enrichment requests in flight"
+    )
+    parser.add_argument("--books-per-request", type=int, default=10)
+    parser.add_argument(
+        "--lsh-tables", type=int, default=0, help="approximate similarity stage"
+    )
+    parser.add_argument(
+        "--recommendations", type=int, default=1000, help="users served after the build"
+    )
+    parser.add_argument(
+        "--neo4j-latency", type=float, default=0.0, help="seconds per fake round trip"
+    )
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    parser.add_argument("--sparql-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--neo4j-uri", help="benchmark a real database (it is wiped!) instead of the fake"
+    )
+    parser.add_argument("--neo4j-user", default="neo4j")
+    parser.add_argument("--neo4j-password", default="neo4j")
+    parser.add_argument("--stages", nargs="+", choices=STAGES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workdir", help="directory of raw_data/ and processed_data/, temporary by default"
+    )
+    parser.add_argument(
+        "--output", help="write the report as JSON, to compare runs across commits"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="goodreads-bench-")
+    os.makedirs(os.path.join(workdir, "raw_data"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "processed_data"), exist_ok=True)
+    # DataProcessor and GraphCreator read and write relative to the working directory
+    os.chdir(workdir)
+    print(f"{'stage':>22} {'time':>10} {'items':>16} {'throughput':>11}")
+    results = PipelineBenchmark(args).run()
+    if output:
+        report = {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "parameters": vars(args),
+            "stages": results,
+        }
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
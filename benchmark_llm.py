@@ -0,0 +1,131 @@
+import argparse
+import time
+from fake_openai_server import FakeOpenAIServer
+from LLM_integration import LLMGraphEnrichment
+from rate_limiter import map_bounded
+
+
+def synthetic_books(count):
+    """
+    Build books without descriptions so every book costs the full three LLM requests.
+    """
+    return [
+        {
+            "id": str(i),
+            "name": f"Synthetic Book {i}",
+            "author": f"Synthetic Author {i % 100}",
+            "description": None,
+        }
+        for i in range(count)
+    ]
+
+
+def benchmark_concurrency(enrichment, books, concurrency, combined=False):
+    """
+    Generate the enrichment of every book with the given concurrency and return books/sec.
+    Nothing is written to Neo4j, only the LLM side of the engine is measured.
+    """
+    generate = (
+        enrichment.generate_combined_enrichment
+        if combined
+        else enrichment.generate_enrichment
+    )
+    start = time.perf_counter()
+    failed = 0
+    for _, _, error in map_bounded(generate, books, concurrency):
+        if error is not None:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    return (len(books) - failed) / elapsed, failed
+
+
+def benchmark_packing(enrichment, books, concurrency, books_per_request, token_budget):
+    """
+    Generate the enrichment of every book with books_per_request books per structured
+    request and return (books/sec, tokens/book, requests).
+    """
+    enrichment.usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    if books_per_request > 1:
+        packs = enrichment.pack_books(books, books_per_request, token_budget)
+        generate = enrichment.generate_packed_enrichment
+    else:
+        packs = ([book] for book in books)
+
+        def generate(pack):
+            return [enrichment.generate_combined_enrichment(pack[0])]
+
+    start = time.perf_counter()
+    enriched = 0
+    for _, rows, error in map_bounded(generate, packs, concurrency):
+        if error is None:
+            enriched += len(rows)
+    elapsed = time.perf_counter() - start
+    tokens = enrichment.usage["prompt_tokens"] + enrichment.usage["completion_tokens"]
+    return enriched / elapsed, tokens / len(books), enrichment.usage["requests"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark LLM enrichment books/sec against a fake OpenAI server."
+    )
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--requests-per-minute", type=int, default=None)
+    parser.add_argument("--tokens-per-minute", type=int, default=None)
+    parser.add_argument(
+        "--combined", action="store_true", help="one structured request per book"
+    )
+    parser.add_argument(
+        "--books-per-request",
+        type=int,
+        nargs="+",
+        default=None,
+        help="compare prompt packing sizes (e.g. 1 5 10 20) at the first concurrency",
+    )
+    parser.add_argument("--token-budget", type=int, default=4000)
+    args = parser.parse_args()
+
+    fake_server = FakeOpenAIServer(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate
+    )
+    base_url = fake_server.start()
+    # the Neo4j driver connects lazily, no database is needed for the LLM side
+    enrichment = LLMGraphEnrichment(
+        "neo4j://localhost:7687",
+        "neo4j",
+        "neo4j",
+        "fake-key",
+        openai_base_url=base_url,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+    )
+    books = synthetic_books(args.books)
+    try:
+        if args.books_per_request:
+            concurrency = args.concurrency[0]
+            print(f"{'books/request':>14} {'books/s':>10} {'tokens/book':>12} {'requests':>9}")
+            for books_per_request in args.books_per_request:
+                books_per_second, tokens_per_book, requests = benchmark_packing(
+                    enrichment, books, concurrency, books_per_request, args.token_budget
+                )
+                print(
+                    f"{books_per_request:>14} {books_per_second:>10.2f} "
+                    f"{tokens_per_book:>12.1f} {requests:>9}"
+                )
+        else:
+            print(f"{'concurrency':>12} {'books/s':>10} {'failed':>8}")
+            for concurrency in args.concurrency:
+                books_per_second, failed = benchmark_concurrency(
+                    enrichment, books, concurrency, args.combined
+                )
+                print(f"{concurrency:>12} {books_per_second:>10.2f} {failed:>8}")
+    finally:
+        enrichment.close()
+        fake_server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import csv
+import logging
+import os
+import time
+from define_kg import RATING_COLUMNS, GraphCreator, parse_number
+
+logger = logging.getLogger(__name__)
+
+
+class BulkImportExporter:
+    def __init__(self, output_dir="import"):
+        """
+        Export the cleaned books and ratings as the node and relationship CSV files of
+        `neo4j-admin database import`, to build the graph from scratch offline instead of
+        with transactional MERGEs. The files hold the same nodes, properties and
+        relationships as GraphCreator.generate_book_graph and add_ratings_to_graph.
+        """
+        self.output_dir = output_dir
+        # only used to read the preprocessed files, no database connection is needed
+        self.reader = GraphCreator()
+
+    def path(self, name):
+        return os.path.join(self.output_dir, name)
+
+    def open_output(self, name):
+        return open(self.path(name), "w", newline="", encoding="utf-8")
+
+    def export_books(self, books_filename, batch_size=10000):
+        """
+        Write books.csv, authors.csv and written_by.csv. A book id appearing in several
+        shards is exported once, with its first row.
+        """
+        book_ids = set()
+        authors = set()
+        written_by = set()
+        with (
+            self.open_output("books.csv") as books_file,
+            self.open_output("authors.csv") as authors_file,
+            self.open_output("written_by.csv") as written_by_file,
+        ):
+            books_writer = csv.writer(books_file)
+            authors_writer = csv.writer(authors_file)
+            written_by_writer = csv.writer(written_by_file)
+            books_writer.writerow(
+                [
+                    "id:ID(Book)",
+                    "name",
+                    "rating:float",
+                    "pagesNumber:long",
+                    "publishYear:long",
+                    "publisher",
+                    "language",
+                    "description",
+                ]
+            )
+            authors_writer.writerow(["name:ID(Author)"])
+            written_by_writer.writerow([":START_ID(Book)", ":END_ID(Author)"])
+            for books in self.reader.read_book_batches(books_filename, batch_size):
+                for book in books:
+                    if book["id"] in book_ids:
+                        continue
+                    book_ids.add(book["id"])
+                    books_writer.writerow(
+                        [
+                            book["id"],
+                            book["name"],
+                            book["rating"],
+                            book["pages_number"],
+                            book["publish_year"],
+                            book["publisher"],
+                            book["language"],
+                            book["description"],
+                        ]
+                    )
+                    for author in book["authors"]:
+                        if author not in authors:
+                            authors.add(author)
+                            authors_writer.writerow([author])
+                        if (book["id"], author) not in written_by:
+                            written_by.add((book["id"], author))
+                            written_by_writer.writerow([book["id"], author])
+        return len(book_ids), len(authors), len(written_by)
+
+    def export_ratings(
+        self, ratings_filename, books_filename, batch_size=10000, min_score=0.9
+    ):
+        """
+        Write users.csv and reviewed_by.csv. Titles are resolved like add_ratings_to_graph
+        does, and ratings of unknown titles are skipped.
+        """
+        resolver = self.reader.load_title_resolver(books_filename)
+        book_ids = {}
+        users = set()
+        reviewed_by = set()
+        skipped = 0
+        with (
+            self.open_output("users.csv") as users_file,
+            self.open_output("reviewed_by.csv") as reviewed_by_file,
+        ):
+            users_writer = csv.writer(users_file)
+            reviewed_by_writer = csv.writer(reviewed_by_file)
+            users_writer.writerow(["id:ID(User)"])
+            reviewed_by_writer.writerow(
+                [":START_ID(Book)", ":END_ID(User)", "rating", "num_rating:int"]
+            )
+            for row in self.reader.read_records(ratings_filename, RATING_COLUMNS, batch_size):
+                ids = book_ids.get(row["Name"])
+                if ids is None:
+                    ids = book_ids[row["Name"]] = resolver.resolve_ids(
+                        row["Name"], min_score
+                    )
+                if not ids:
+                    skipped += 1
+                    continue
+                user_id = row["ID"]
+                if user_id not in users:
+                    users.add(user_id)
+                    users_writer.writerow([user_id])
+                num_rating = parse_number(row["NumericalRating"], float)
+                num_rating = int(num_rating) if num_rating is not None else None
+                for book_id in ids:
+                    # identical edges are merged into one, as MERGE does
+                    edge = (book_id, user_id, row["Rating"], num_rating)
+                    if edge not in reviewed_by:
+                        reviewed_by.add(edge)
+                        reviewed_by_writer.writerow(edge)
+        return len(users), len(reviewed_by), skipped
+
+    def import_command(self, database="neo4j"):
+        """
+        The neo4j-admin command importing the exported files into an empty database.
+        """
+        return (
+            f"neo4j-admin database import full {database} --overwrite-destination "
+            f"--nodes=Book={self.path('books.csv')} "
+            f"--nodes=Author={self.path('authors.csv')} "
+            f"--nodes=User={self.path('users.csv')} "
+            f"--relationships=WRITTEN_BY={self.path('written_by.csv')} "
+            f"--relationships=REVIEWED_BY={self.path('reviewed_by.csv')} "
+            "--multiline-fields=true --ignore-empty-strings=true"
+        )
+
+    def export(self, books_filename, ratings_filename, database="neo4j"):
+        start = time.perf_counter()
+        os.makedirs(self.output_dir, exist_ok=True)
+        books, authors, written_by = self.export_books(books_filename)
+        logger.info(f"Exported {books} books, {authors} authors and {written_by} WRITTEN_BY.")
+        users, reviewed_by, skipped = self.export_ratings(ratings_filename, books_filename)
+        logger.info(
+            f"Exported {users} users and {reviewed_by} REVIEWED_BY, skipped {skipped} "
+            f"ratings of unknown titles."
+        )
+        logger.info(f"Export done in {time.perf_counter() - start:.2f}s.")
+        print("Stop the database, then run:")
+        print(self.import_command(database))
+        print("and create the schema (GraphCreator.create_schema) once it is started.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the cleaned books and ratings for neo4j-admin database import."
+    )
+    parser.add_argument("--books", default="cleaned_books-small")
+    parser.add_argument("--ratings", default="cleaned_ratings")
+    parser.add_argument("--output", default="import")
+    parser.add_argument("--database", default="neo4j")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    BulkImportExporter(args.output).export(args.books, args.ratings, args.database)
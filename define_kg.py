@@ -1,18 +1,271 @@
 import csv
+import logging
+import os
+import time
+from metrics import ProgressReporter, metrics
 from neo4j_manager import Neo4jConnector
+from schema_manager import SchemaManager
+from title_resolver import TitleResolver
+
+logger = logging.getLogger(__name__)
+
+BOOK_COLUMNS = [
+    "Id",
+    "Name",
+    "Authors",
+    "Rating",
+    "pagesNumber",
+    "PublishYear",
+    "Publisher",
+    "Language",
+    "Description",
+]
+
+RATING_COLUMNS = ["ID", "Name", "Rating", "NumericalRating"]
+
+
+def parse_number(value, number_type):
+    """
+    Convert a CSV field, or an already typed Parquet value, to a number (None if empty).
+    """
+    if value is None or value == "":
+        return None
+    return number_type(value)
 
 
 class GraphCreator:
+    # Relationship types and node labels deleted by each scope of reset_graph, in order
+    RESET_SCOPES = {
+        "all": {"relationships": [None], "labels": [None]},
+        "ratings": {
+            "relationships": ["REVIEWED_BY", "CO_RATED_SIMILAR"],
+            "labels": ["User"],
+        },
+        "enrichment": {
+            "relationships": [
+                "SIMILAR_TO",
+                "HAS_GENRE",
+                "HAS_SUBJECT",
+                "HAS_ADAPTATION",
+                "SUBSEQUENT_EDITION",
+                "PRECEDING_EDITION",
+            ],
+            "labels": ["Genre", "Subject", "Adaptation"],
+        },
+    }
+
     def __init__(self):
         self.db = None
 
-    def connect_to_neo4j(self, uri, user, password):
-        self.db = Neo4jConnector(uri, user, password)
+    def connect_to_neo4j(
+        self, uri, user, password, max_connection_pool_size=100, fetch_size=1000
+    ):
+        self.db = Neo4jConnector(
+            uri,
+            user,
+            password,
+            max_connection_pool_size=max_connection_pool_size,
+            fetch_size=fetch_size,
+        )
+
+    def create_schema(self, report_index_usage=False):
+        """
+        Create the constraints and indexes the loaders rely on before any data is written.
+        """
+        if self.db is not None:
+            schema_manager = SchemaManager(self.db)
+            schema_manager.create_schema()
+            if report_index_usage:
+                schema_manager.explain_index_usage()
+        else:
+            logger.error("Database is not connected")
+
+    def reset_graph(self, scope="all", batch_size=10000):
+        """
+        Delete part of the graph in transactions of batch_size rows, so that no single
+        transaction has to hold millions of deletions. Relationships are deleted before
+        their nodes so that deleting a node never drags a huge number of edges along.
+
+        :param scope: "all" for the whole graph, "ratings" for REVIEWED_BY, User nodes and
+            the CO_RATED_SIMILAR edges derived from them,
+            "enrichment" for the LLM and DBpedia edges and nodes, also clearing the
+            enrichment properties and progress markers so the stages run again (book
+            descriptions are kept, they cannot be told apart from the source ones).
+        :param batch_size: Number of rows deleted per transaction.
+        """
+        if self.db is None:
+            logger.error("Database is not connected")
+            return
+        targets = self.RESET_SCOPES[scope]
+        start = time.perf_counter()
+        batch = f"IN TRANSACTIONS OF {int(batch_size)} ROWS"
+        for rel_type in targets["relationships"]:
+            pattern = f"()-[r:{rel_type}]->()" if rel_type else "()-[r]->()"
+            self.report_reset(
+                rel_type or "all relationships",
+                f"MATCH {pattern} CALL {{ WITH r DELETE r }} {batch}",
+                start,
+            )
+        for label in targets["labels"]:
+            pattern = f"(n:{label})" if label else "(n)"
+            self.report_reset(
+                label or "all nodes",
+                f"MATCH {pattern} CALL {{ WITH n DETACH DELETE n }} {batch}",
+                start,
+            )
+        if scope == "enrichment":
+            self.report_reset(
+                "Book enrichment properties",
+                f"""
+                MATCH (b:Book)
+                WHERE b.llm_pipeline_version IS NOT NULL
+                   OR b.dbpedia_pipeline_version IS NOT NULL
+                CALL {{
+                    WITH b
+                    REMOVE b.genre, b.themes, b.audience,
+                           b.llm_enriched_at, b.llm_pipeline_version,
+                           b.dbpedia_enriched_at, b.dbpedia_pipeline_version
+                }} {batch}
+                """,
+                start,
+            )
+            self.report_reset(
+                "Author enrichment properties",
+                f"""
+                MATCH (a:Author)
+                WHERE a.dbpedia_pipeline_version IS NOT NULL
+                CALL {{
+                    WITH a
+                    REMOVE a.biography, a.birthplace,
+                           a.dbpedia_enriched_at, a.dbpedia_pipeline_version
+                }} {batch}
+                """,
+                start,
+            )
+        logger.info(f"Reset '{scope}' done in {time.perf_counter() - start:.2f}s.")
+
+    def report_reset(self, target, query, start):
+        counters = self.db.run_auto_commit(query)
+        logger.info(
+            f"Reset {target}: {counters or 'nothing to delete'} "
+            f"({time.perf_counter() - start:.2f}s elapsed)."
+        )
+
+    def read_records(self, filename, columns, batch_size=10000):
+        """
+        Stream the rows of a preprocessed file as dictionaries. The partitioned Parquet
+        output of DataProcessor (processed_data/<filename>/) is read as typed record
+        batches of batch_size rows, otherwise the cleaned CSV is parsed.
+        """
+        directory = f"processed_data/{filename}"
+        if os.path.isdir(directory):
+            # imported lazily, pyarrow is only needed for the Parquet output
+            import pyarrow.dataset as ds
+
+            dataset = ds.dataset(directory, format="parquet")
+            columns = [column for column in columns if column in dataset.schema.names]
+            for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+                yield from batch.to_pylist()
+        else:
+            with open(f"{directory}.csv", "r", encoding="utf-8") as file:
+                yield from csv.DictReader(file)
+
+    def read_book_batches(self, filename, batch_size):
+        """
+        Stream the cleaned books and yield lists of typed book rows of at most batch_size.
+        """
+        batch = []
+        for row in self.read_records(filename, BOOK_COLUMNS, batch_size):
+            if not row["Name"]:
+                continue
+            description = row.get("Description")
+            batch.append(
+                {
+                    "id": row["Id"],
+                    "name": row["Name"],
+                    "rating": parse_number(row["Rating"], float),
+                    "pages_number": parse_number(row["pagesNumber"], int),
+                    "publish_year": parse_number(row["PublishYear"], int),
+                    "publisher": row["Publisher"],
+                    "language": row["Language"],
+                    "description": None if description == "None" else description,
+                    "authors": [author.strip() for author in row["Authors"].split(";")],
+                }
+            )
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write_book_batch(self, books):
+        """
+        Write one batch of books, then their authors and WRITTEN_BY edges, using one UNWIND
+        query each, both committed in a single transaction.
+        """
+        self.db.run_in_transaction(
+            [
+                (
+                    """
+                    UNWIND $rows AS row
+                    MERGE (b:Book {id: row.id})
+                    SET b.name = row.name,
+                        b.rating = row.rating,
+                        b.pagesNumber = row.pages_number,
+                        b.publishYear = row.publish_year,
+                        b.publisher = row.publisher,
+                        b.language = row.language,
+                        b.description = row.description
+                    """,
+                    {"rows": books},
+                ),
+                (
+                    """
+                    UNWIND $rows AS row
+                    MATCH (b:Book {id: row.book_id})
+                    MERGE (a:Author {name: row.author_name})
+                    MERGE (b)-[:WRITTEN_BY]->(a)
+                    """,
+                    {
+                        "rows": [
+                            {"book_id": book["id"], "author_name": author}
+                            for book in books
+                            for author in book["authors"]
+                        ]
+                    },
+                ),
+            ]
+        )
+
+    def generate_book_graph(self, filename, batch_size=10000):
+        """
+        Bulk load the cleaned books (CSV or Parquet), sending each chunk of batch_size
+        rows as one transaction with an UNWIND query for Book nodes and one for Author
+        nodes and WRITTEN_BY edges.
+        """
+        if self.db is not None:
+            self.reset_graph("all")
+            progress = ProgressReporter("Book graph", unit="books")
+            for books in self.read_book_batches(filename, batch_size):
+                with metrics.timer("batch_write_seconds", stage="books"):
+                    self.write_book_batch(books)
+                progress.update(len(books))
+            metrics.inc("books_loaded_total", progress.done)
+            progress.finish()
+        else:
+            logger.error("Database is not connected")
 
-    def generate_book_graph(self, filename):
+    def generate_book_graph_row_by_row(self, filename):
+        """
+        Load the books of a cleaned CSV with one query per book and per author.
+        Much slower than generate_book_graph, kept for debugging individual rows.
+        """
         if self.db is not None:
-            self.db.run_query("MATCH (n) DETACH DELETE n")
-            with open(f"processed_data/{filename}.csv", "r", encoding="utf-8") as file:
+            self.reset_graph("all")
+            # reuse one session for the many small queries
+            with self.db.session(), open(
+                f"processed_data/{filename}.csv", "r", encoding="utf-8"
+            ) as file:
                 reader = csv.DictReader(file)
                 for row in reader:
                     if not row["Name"]:
@@ -59,54 +312,119 @@ class GraphCreator:
                                 "book_id": row["Id"],
                             },
                         )
-                    print(f"Added book '{row['Name']}' to the graph.")
+                    logger.debug(f"Added book '{row['Name']}' to the graph.")
+        else:
+            logger.error("Database is not connected")
+
+    def load_title_resolver(self, books_filename=None, path=None):
+        """
+        Title resolver of the books, built from the cleaned books if books_filename is
+        given, otherwise loaded from path if it exists or built once from the graph.
+        A built resolver is saved to path, so that later stages load it in a moment, and
+        a file saved by another version of TitleResolver is replaced.
+        """
+        if books_filename is None and path is not None and os.path.exists(path):
+            try:
+                return TitleResolver.load(path)
+            except ValueError as e:
+                logger.warning(f"{e} Rebuilding it from the graph.")
+        if books_filename is not None:
+            resolver = TitleResolver.from_books(
+                book
+                for books in self.read_book_batches(books_filename, 10000)
+                for book in books
+            )
         else:
-            print("Database is not connected")
+            resolver = TitleResolver.from_graph(self.db)
+        if path is not None:
+            resolver.save(path)
+        return resolver
 
-    def add_ratings_to_graph(self, filename):
+    def add_ratings_to_graph(
+        self,
+        filename,
+        batch_size=10000,
+        books_filename=None,
+        title_index_path=None,
+        min_score=0.9,
+    ):
+        """
+        Load the cleaned ratings (CSV or Parquet) as User nodes and REVIEWED_BY edges.
+        Titles are resolved to Book ids in memory with a TitleResolver (see
+        load_title_resolver), only fuzzy matches scoring at least min_score are kept and
+        unknown titles are skipped locally, each chunk of batch_size ratings is then
+        written with a single UNWIND query.
+        """
         if self.db is not None:
             # delete existing relationships and users
-            self.db.run_query("MATCH (u:User)<-[r:REVIEWED_BY]-() DELETE r, u")
-            self.db.run_query("MATCH (u:User) DELETE u")
-            with open(f"processed_data/{filename}.csv", "r", encoding="utf-8") as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    # Check if the book exists
-                    book_exists = self.db.run_query(
-                        "MATCH (b:Book {name: $book_name}) RETURN b",
-                        {"book_name": row["Name"]},
-                        single=True,
-                    )
-                    # Skip if book does not exist in db
-                    if not book_exists:
-                        print(f"Book '{row['Name']}' not found in the graph. Skipping.")
-                        continue
-                    # Create User Node
-                    self.db.run_query(
-                        """
-                        MERGE (u:User {id: $user_id})
-                        """,
-                        {"user_id": row["ID"]},
+            self.reset_graph("ratings")
+            resolver = self.load_title_resolver(books_filename, title_index_path)
+            # ids of each title already resolved, titles are rated many times
+            book_ids = {}
+            skipped = 0
+            skipped_titles = set()
+            progress = ProgressReporter("Ratings", unit="ratings")
+            batch = []
+            for row in self.read_records(filename, RATING_COLUMNS, batch_size):
+                ids = book_ids.get(row["Name"])
+                if ids is None:
+                    ids = book_ids[row["Name"]] = resolver.resolve_ids(
+                        row["Name"], min_score
                     )
-
-                    # Create REVIEWED_BY Relationship
-                    self.db.run_query(
-                        """
-                        MATCH (b:Book {name: $book_name})
-                        MATCH (u:User {id: $user_id})
-                        MERGE (b)-[:REVIEWED_BY {rating: $rating, num_rating: $num_rating}]->(u)
-                        """,
-                        {
-                            "book_name": row["Name"],
-                            "user_id": row["ID"],
-                            "rating": row["Rating"],
-                            "num_rating": row["NumericalRating"],
-                        },
-                    )
-                    print(f"Added rating for book '{row['Name']}' to the graph.")
-
+                # Skip if book does not exist in db
+                if not ids:
+                    skipped += 1
+                    skipped_titles.add(row["Name"])
+                    continue
+                # None for the labels without a numerical value, empty in the CSV
+                num_rating = parse_number(row["NumericalRating"], float)
+                batch.append(
+                    {
+                        "user_id": row["ID"],
+                        "book_ids": ids,
+                        "rating": row["Rating"],
+                        "num_rating": int(num_rating) if num_rating is not None else None,
+                    }
+                )
+                if len(batch) >= batch_size:
+                    with metrics.timer("batch_write_seconds", stage="ratings"):
+                        self.write_rating_batch(batch)
+                    progress.update(len(batch), skipped=skipped)
+                    batch = []
+            if batch:
+                with metrics.timer("batch_write_seconds", stage="ratings"):
+                    self.write_rating_batch(batch)
+                progress.update(len(batch), skipped=skipped)
+            metrics.inc("ratings_total", progress.done, outcome="added")
+            metrics.inc("ratings_total", skipped, outcome="skipped")
+            progress.finish(
+                skipped=f"{skipped} ratings of {len(skipped_titles)} titles not in the graph"
+            )
         else:
-            print("Database is not connected")
+            logger.error("Database is not connected")
+
+    def write_rating_batch(self, ratings):
+        """
+        Write one batch of ratings as User nodes and REVIEWED_BY edges keyed by Book id.
+        The edges are merged on the rating label only, MERGE rejects null properties and
+        num_rating is null for the labels without a numerical value.
+        """
+        self.db.run_in_transaction(
+            [
+                (
+                    """
+                    UNWIND $rows AS row
+                    MERGE (u:User {id: row.user_id})
+                    WITH u, row
+                    UNWIND row.book_ids AS book_id
+                    MATCH (b:Book {id: book_id})
+                    MERGE (b)-[r:REVIEWED_BY {rating: row.rating}]->(u)
+                    SET r.num_rating = row.num_rating
+                    """,
+                    {"rows": ratings},
+                )
+            ]
+        )
 
     def disconnect_from_neo4j(self):
         self.db.close()
@@ -0,0 +1,168 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, jitter=0.0, error_rate=0.0):
+        """
+        Local stand-in for the OpenAI chat completions API, answering the enrichment prompts
+        with canned text after latency (+/- jitter) seconds and failing error_rate of the
+        requests with a 429 so retries and backoff can be exercised offline.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """
+        Serve requests from a background thread and return the base URL for the client.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def answer(self, prompt):
+        """
+        Build a plausible answer for one of the enrichment prompts.
+        """
+        if "concise description" in prompt:
+            return "A synthetic description of the book, generated by the fake server."
+        if "Extract the genre" in prompt:
+            return "Genre: Fiction\nThemes: friendship, adventure\nAudience: Young adults"
+        if "similar books" in prompt:
+            return "Synthetic Book 1, Synthetic Book 2, Synthetic Book 3"
+        return "none"
+
+    def answer_function(self, name, prompt):
+        """
+        Build the arguments of a call to the function the client forces with tool_choice.
+        """
+        if name == "record_book_enrichment":
+            return {
+                "description": None
+                if "Analyze the following description" in prompt
+                else "A synthetic description of the book, generated by the fake server.",
+                "genre": "Fiction",
+                "themes": "friendship, adventure",
+                "audience": "Young adults",
+                "similar_books": ["Synthetic Book 1", "Synthetic Book 2"],
+            }
+        if name == "record_books_enrichment":
+            books = []
+            for book_id in re.findall(r'"id": "([^"]*)"', prompt):
+                item = self.answer_function("record_book_enrichment", "")
+                item["id"] = book_id
+                books.append(item)
+            return {"books": books}
+        return {}
+
+    def handle_completion(self, request):
+        """
+        Turn a chat completion request body into (status, response body).
+        """
+        with self.lock:
+            self.requests += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(delay, 0))
+        if random.random() < self.error_rate:
+            return 429, {
+                "error": {
+                    "message": "Rate limit reached (fake server).",
+                    "type": "rate_limit_error",
+                    "code": "rate_limit_exceeded",
+                }
+            }
+        prompt = "\n".join(message["content"] for message in request["messages"])
+        message = {"role": "assistant", "content": None}
+        if request.get("tool_choice"):
+            name = request["tool_choice"]["function"]["name"]
+            arguments = json.dumps(self.answer_function(name, prompt))
+            message["tool_calls"] = [
+                {
+                    "id": f"call_fake_{self.requests}",
+                    "type": "function",
+                    "function": {"name": name, "arguments": arguments},
+                }
+            ]
+            completion = arguments
+        else:
+            message["content"] = completion = self.answer(prompt)
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(completion) // 4 + 1
+        return 200, {
+            "id": f"chatcmpl-fake-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if "tool_calls" in message else "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                status, body = server.handle_completion(request)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible server.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake_server = FakeOpenAIServer(
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+    print(f"Fake OpenAI server listening on {fake_server.base_url}")
+    fake_server.httpd.serve_forever()
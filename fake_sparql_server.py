@@ -0,0 +1,241 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Small fixture used when no recorded fixture file is given
+SAMPLE_FIXTURE = {
+    "books": {
+        "The Hobbit": {
+            "description": "The Hobbit is a children's fantasy novel by J. R. R. Tolkien.",
+            "genres": ["http://dbpedia.org/resource/Fantasy"],
+            "subjects": ["http://dbpedia.org/resource/Category:1937_British_novels"],
+            "adaptations": ["http://dbpedia.org/resource/The_Hobbit_(film_series)"],
+            "preceding": [],
+            "subsequent": ["The Lord of the Rings"],
+        },
+        "The Lord of the Rings": {
+            "description": "The Lord of the Rings is an epic high-fantasy novel.",
+            "genres": [
+                "http://dbpedia.org/resource/Fantasy",
+                "http://dbpedia.org/resource/Adventure_novel",
+            ],
+            "subjects": ["http://dbpedia.org/resource/Category:High_fantasy_novels"],
+            "adaptations": [],
+            "preceding": ["The Hobbit"],
+            "subsequent": [],
+        },
+    },
+    "persons": {
+        "J. R. R. Tolkien": {
+            "biography": "John Ronald Reuel Tolkien was an English writer and philologist.",
+            "birthplace": "http://dbpedia.org/resource/Bloemfontein",
+        }
+    },
+}
+
+LITERAL = r'"((?:[^"\\]|\\.)*)"'
+
+# Variable selected by each single-property query of DBpediaEnrichment -> fixture field
+BOOK_VARIABLES = {
+    "abstract": "description",
+    "genre": "genres",
+    "subject": "subjects",
+    "adaptation": "adaptations",
+}
+
+
+def unescape(value):
+    return re.sub(r"\\([\"\\])", r"\1", value)
+
+
+def literal(value, lang=None):
+    term = {"type": "literal", "value": value}
+    if lang:
+        term["xml:lang"] = lang
+    return term
+
+
+def uri_or_literal(value):
+    if value.startswith("http://") or value.startswith("https://"):
+        return {"type": "uri", "value": value}
+    return literal(value, "en")
+
+
+class FakeSparqlServer:
+    def __init__(self, fixture=None, host="127.0.0.1", port=0, latency=0.1, error_rate=0.0):
+        """
+        Local stand-in for the DBpedia SPARQL endpoint answering the queries issued by
+        DBpediaEnrichment from a recorded fixture of books and persons, after latency
+        seconds, and failing error_rate of the requests with a 503.
+        """
+        self.fixture = fixture or SAMPLE_FIXTURE
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def endpoint(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/sparql"
+
+    def start(self):
+        """
+        Serve requests from a background thread and return the endpoint URL.
+        """
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.endpoint
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def values_block(self, query, variable):
+        """
+        Return the literals listed in the VALUES block of variable, or None.
+        """
+        match = re.search(r"VALUES\s+\?" + variable + r"\s*\{(.*?)\}", query, re.S)
+        if match is None:
+            return None
+        return [unescape(value) for value in re.findall(LITERAL, match.group(1))]
+
+    def answer(self, query):
+        """
+        Build the (variables, bindings) answering a query of DBpediaEnrichment.
+        """
+        books = self.fixture.get("books", {})
+        persons = self.fixture.get("persons", {})
+
+        titles = self.values_block(query, "title")
+        if titles is not None:
+            bindings = []
+            for title in titles:
+                book = books.get(title, {})
+                for prop, values in book.items():
+                    values = [values] if isinstance(values, str) else values or []
+                    for value in values:
+                        bindings.append(
+                            {
+                                "title": literal(title, "en"),
+                                "property": literal(prop),
+                                "value": uri_or_literal(value)
+                                if prop != "description"
+                                else literal(value, "en"),
+                            }
+                        )
+            return ["title", "property", "value"], bindings
+
+        names = self.values_block(query, "name")
+        if names is not None:
+            bindings = []
+            for name in names:
+                for prop, value in persons.get(name, {}).items():
+                    if value:
+                        bindings.append(
+                            {
+                                "name": literal(name, "en"),
+                                "property": literal(prop),
+                                "value": uri_or_literal(value)
+                                if prop != "biography"
+                                else literal(value, "en"),
+                            }
+                        )
+            return ["name", "property", "value"], bindings
+
+        match = re.search(r"(?:foaf:name|rdfs:label)\s+" + LITERAL, query)
+        if match is None:
+            return [], []
+        name = unescape(match.group(1))
+        variables = re.search(r"SELECT\s+(.*?)\s+WHERE", query, re.S).group(1)
+        variables = [variable.lstrip("?") for variable in variables.split()]
+
+        if "dbo:Person" in query:
+            person = persons.get(name, {})
+            field = "biography" if variables == ["abstract"] else "birthplace"
+            value = person.get(field)
+            if not value:
+                return variables, []
+            return variables, [{variables[0]: uri_or_literal(value)}]
+
+        book = books.get(name, {})
+        if variables == ["subsequentWork", "precedingWork"]:
+            if not book.get("subsequent") or not book.get("preceding"):
+                return variables, []
+            return variables, [
+                {
+                    "subsequentWork": uri_or_literal(book["subsequent"][0]),
+                    "precedingWork": uri_or_literal(book["preceding"][0]),
+                }
+            ]
+        values = book.get(BOOK_VARIABLES.get(variables[0], ""), [])
+        values = [values] if isinstance(values, str) else values or []
+        return variables, [{variables[0]: uri_or_literal(value)} for value in values]
+
+    def handle_query(self, query):
+        """
+        Turn a SPARQL query into (status, response body).
+        """
+        with self.lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            return 503, {"error": "Service temporarily unavailable (fake server)."}
+        variables, bindings = self.answer(query)
+        return 200, {"head": {"vars": variables}, "results": {"bindings": bindings}}
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, params):
+                query = params.get("query", [""])[0]
+                status, body = server.handle_query(query)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/sparql-results+json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.respond(parse_qs(urlparse(self.path).query))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith(
+                    "application/sparql-query"
+                ):
+                    self.respond({"query": [body]})
+                else:
+                    self.respond(parse_qs(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fixture-backed SPARQL server.")
+    parser.add_argument("--fixture", help="JSON file with 'books' and 'persons'")
+    parser.add_argument("--port", type=int, default=8890)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fixture = None
+    if args.fixture:
+        with open(args.fixture, "r", encoding="utf-8") as file:
+            fixture = json.load(file)
+    fake_server = FakeSparqlServer(
+        fixture, port=args.port, latency=args.latency, error_rate=args.error_rate
+    )
+    print(f"Fake SPARQL endpoint listening on {fake_server.endpoint}")
+    fake_server.httpd.serve_forever()
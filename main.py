@@ -1,9 +1,14 @@
 from DBPedia_integration import DBpediaEnrichment
 from preprocess_data import DataProcessor
+import logging
 import os
 from dotenv import load_dotenv
 from define_kg import GraphCreator
 from LLM_integration import LLMGraphEnrichment
+from metrics import metrics
+from recommendation import RecommendationEngine
+from response_cache import ResponseCache
+from similarity_engine import SimilarityEngine
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,53 +16,155 @@ neo4j_uri = os.getenv("NEO4J_URI")
 neo4j_username = os.getenv("NEO4J_USERNAME")
 neo4j_password = os.getenv("NEO4J_PASSWORD")
 openai_api_key = os.getenv("OPENAI_API_KEY")
+llm_cache_path = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+# replay a previous enrichment from the cache only, without any OpenAI request
+llm_cache_replay = os.getenv("LLM_CACHE_REPLAY", "").lower() in ("1", "true", "yes")
+# answer the DBpedia stage from a local index (see DBPedia_index.py) instead of the endpoint
+dbpedia_index_path = os.getenv("DBPEDIA_INDEX_PATH")
+dbpedia_cache_path = os.getenv("DBPEDIA_CACHE_PATH", "dbpedia_cache.sqlite")
+# cache file of a previous run (e.g. on another machine) to import before enriching
+dbpedia_cache_prewarm = os.getenv("DBPEDIA_CACHE_PREWARM")
+# title index built while loading the ratings and reused by the LLM stage
+title_index_path = os.getenv("TITLE_INDEX_PATH", "title_index.pickle")
+# LSH tables of the content similarity stage, 0 compares every pair of books exactly
+similarity_lsh_tables = int(os.getenv("SIMILARITY_LSH_TABLES", "0"))
+# write the item-item similarities of the ratings as CO_RATED_SIMILAR relationships
+co_rated_edges = os.getenv("CO_RATED_EDGES", "true").lower() in ("1", "true", "yes")
+# processes cleaning the raw shards and computing the item similarities, defaults to
+# the number of CPUs
+preprocess_workers = int(os.getenv("PREPROCESS_WORKERS", "0")) or None
+# DEBUG also logs every processed row
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+# Prometheus text file, or JSON summary if the name ends with .json
+metrics_path = os.getenv("METRICS_PATH", "metrics.prom")
 
 
 def main():
+    logging.basicConfig(
+        level=log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    try:
+        run_pipeline()
+    finally:
+        metrics.write(metrics_path)
+
+
+def run_pipeline():
     
     # PROCESS DATA
     
-    book_processor = DataProcessor(fileoutput="cleaned_books-small")
-    book_processor.reset_data()
-    book_processor.process_books(filename="book-small")
-    book_processor.process_books(filename="book700k-800k")
-    book_processor.process_books(filename="book1-100k")
-    for i in range(1, 20):
-        book_processor.process_books(filename=f"book{i}00k-{i+1}00k")
+    with metrics.timer("stage_seconds", stage="process_books"):
+        book_processor = DataProcessor(fileoutput="cleaned_books-small")
+        book_processor.reset_data()
+        book_processor.process_books_parallel(
+            ["book-small", "book700k-800k", "book1-100k"]
+            + [f"book{i}00k-{i+1}00k" for i in range(1, 20)],
+            workers=preprocess_workers,
+        )
+        book_processor.save_authors()
 
-    rating_processor = DataProcessor(fileoutput="cleaned_ratings")
-    rating_processor.reset_data()
-    for i in range(0, 6000, 1000):
-        rating_processor.process_ratings(filename=f"user_rating_{i}_to_{i+1000}")
-    rating_processor.process_ratings(filename="user_rating_6000_to_11000")
+    with metrics.timer("stage_seconds", stage="process_ratings"):
+        rating_processor = DataProcessor(fileoutput="cleaned_ratings")
+        rating_processor.reset_data()
+        rating_processor.process_ratings_parallel(
+            [f"user_rating_{i}_to_{i+1000}" for i in range(0, 6000, 1000)]
+            + ["user_rating_6000_to_11000"],
+            workers=preprocess_workers,
+        )
 
     # DEFINE KNOWLEDGE GRAPH
     
     graph_creator = GraphCreator()
     graph_creator.connect_to_neo4j(neo4j_uri, neo4j_username, neo4j_password)
-    graph_creator.generate_book_graph("cleaned_books-small")
-    graph_creator.add_ratings_to_graph("cleaned_ratings")
+    with metrics.timer("stage_seconds", stage="create_schema"):
+        graph_creator.create_schema(report_index_usage=True)
+    with metrics.timer("stage_seconds", stage="generate_book_graph"):
+        graph_creator.generate_book_graph("cleaned_books-small", batch_size=10000)
+    with metrics.timer("stage_seconds", stage="add_ratings_to_graph"):
+        graph_creator.add_ratings_to_graph(
+            "cleaned_ratings",
+            batch_size=10000,
+            books_filename="cleaned_books-small",
+            title_index_path=title_index_path,
+        )
     graph_creator.disconnect_from_neo4j()
 
     # ENRICH KNOWLEDGE GRAPH WITH LLM
     
     LLM_graph_enrichment = LLMGraphEnrichment(
-        neo4j_uri, neo4j_username, neo4j_password, openai_api_key
+        neo4j_uri,
+        neo4j_username,
+        neo4j_password,
+        openai_api_key,
+        cache=ResponseCache(
+            llm_cache_path,
+            ttl_seconds=30 * 24 * 3600,
+            max_entries=5_000_000,
+            read_only=llm_cache_replay,
+        ),
+        title_resolver=title_index_path,
     )
     try:
-        LLM_graph_enrichment.enrich_with_LLM()
+        with metrics.timer("stage_seconds", stage="llm_enrichment"):
+            LLM_graph_enrichment.enrich_with_LLM_concurrent(
+                concurrency=8, write_batch_size=100, combined=True, books_per_request=10
+            )
     finally:
         LLM_graph_enrichment.close()
 
+    # LINK BOOKS WITH SIMILAR CONTENT
+
+    similarity_engine = SimilarityEngine(
+        neo4j_uri,
+        neo4j_username,
+        neo4j_password,
+        top_k=10,
+        lsh_tables=similarity_lsh_tables,
+    )
+    try:
+        with metrics.timer("stage_seconds", stage="similarity"):
+            similarity_engine.build_similarity_graph(batch_size=10000)
+    finally:
+        similarity_engine.close()
+
+    # RECOMMEND BOOKS FROM THE RATINGS
+
+    recommendation_engine = RecommendationEngine(
+        neo4j_uri,
+        neo4j_username,
+        neo4j_password,
+        top_k=20,
+        workers=preprocess_workers,
+    )
+    try:
+        with metrics.timer("stage_seconds", stage="recommendation"):
+            recommendation_engine.build()
+            if co_rated_edges:
+                recommendation_engine.write_similar_edges(batch_size=10000)
+    finally:
+        recommendation_engine.close()
+
     # ENRICH KNOWLEDGE GRAPH WITH DBPEDIA
     
+    dbpedia_cache = ResponseCache(
+        dbpedia_cache_path,
+        ttl_seconds=90 * 24 * 3600,
+        max_entries=2_000_000,
+        memory_entries=100_000,
+    )
+    dbpedia_cache.prewarm(dbpedia_cache_prewarm)
     dbpedia_enrichment = DBpediaEnrichment(
         neo4j_uri=neo4j_uri,
         neo4j_user=neo4j_username,
         neo4j_password=neo4j_password,
+        max_workers=4,
+        requests_per_minute=300,
+        offline_index=dbpedia_index_path,
+        cache=dbpedia_cache,
     )
     try:
-        dbpedia_enrichment.enrich_graph_with_dbpedia()
+        with metrics.timer("stage_seconds", stage="dbpedia_enrichment"):
+            dbpedia_enrichment.enrich_graph_with_dbpedia_batched(batch_size=50)
     finally:
         dbpedia_enrichment.close()
     
@@ -0,0 +1,226 @@
+import bisect
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Fixed-bucket histogram, cheap enough to observe every query of a run.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket holding it.
+        """
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            if count and cumulative >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        Thread-safe counters and histograms identified by a name and labels, exported as
+        a Prometheus text file or a JSON summary.
+        """
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Add amount to a counter, e.g. inc("sparql_queries_total", outcome="error").
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """
+        Record a value (usually a duration in seconds) in a histogram.
+        """
+        key = self.key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time the with block into the histogram name, failures included.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in labels
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def to_prometheus(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{self.format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (math.inf,), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else repr(float(bound))
+                    lines.append(
+                        f"{name}_bucket{self.format_labels(labels, [('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{self.format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        """
+        Summarize the metrics as {"counters": [...], "histograms": [...]}.
+        """
+        with self.lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **histogram.summary()}
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def write(self, path):
+        """
+        Export the metrics to path, as JSON if it ends with .json, otherwise in the
+        Prometheus text format (e.g. for the node exporter textfile collector).
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            if path.endswith(".json"):
+                json.dump(self.to_dict(), file, indent=2)
+            else:
+                file.write(self.to_prometheus())
+        logger.info(f"Wrote metrics to '{path}'.")
+
+
+# Registry shared by every stage of the pipeline
+metrics = MetricsRegistry()
+
+
+class ProgressReporter:
+    def __init__(self, name, total=None, unit="rows", interval=10.0):
+        """
+        Log the progress of a long loop at most every interval seconds, with its rate
+        and, when the total is known, an ETA.
+        """
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, count=1, **details):
+        """
+        Count count more processed items; details are appended to the progress line.
+        """
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now, details)
+
+    def report(self, now, details):
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        progress = f"{self.done} {self.unit}"
+        if self.total:
+            progress = f"{self.done}/{self.total} {self.unit} ({self.done / self.total:.1%}"
+            if rate:
+                remaining = int(max(self.total - self.done, 0) / rate)
+                hours, remaining = divmod(remaining, 3600)
+                progress += f", ETA {hours}:{remaining // 60:02d}:{remaining % 60:02d}"
+            progress += ")"
+        extra = "".join(f", {key} {value}" for key, value in details.items())
+        logger.info(f"{self.name}: {progress}, {rate:.1f} {self.unit}/s{extra}.")
+
+    def finish(self, **details):
+        """
+        Log the final count, rate and elapsed time; return the elapsed seconds.
+        """
+        now = time.perf_counter()
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed else 0.0
+        extra = "".join(f", {key} {value}" for key, value in details.items())
+        logger.info(
+            f"{self.name}: {self.done} {self.unit} in {elapsed:.2f}s "
+            f"({rate:.1f} {self.unit}/s{extra})."
+        )
+        return elapsed
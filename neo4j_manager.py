@@ -1,12 +1,102 @@
+import itertools
+import threading
+from contextlib import contextmanager
 from neo4j import GraphDatabase
+from metrics import metrics
 
 class Neo4jConnector:
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(
+        self, uri, user, password, max_connection_pool_size=100, fetch_size=1000
+    ):
+        """
+        Connect to Neo4j.
+
+        :param max_connection_pool_size: Maximum number of pooled connections.
+        :param fetch_size: Default number of records pulled from the server at a time.
+        """
+        self.driver = GraphDatabase.driver(
+            uri, auth=(user, password), max_connection_pool_size=max_connection_pool_size
+        )
+        self.fetch_size = fetch_size
+        # session opened by session() for the current thread, sessions are not thread safe
+        self.local = threading.local()
 
     def close(self):
         self.driver.close()
 
+    @contextmanager
+    def session(self):
+        """
+        Reuse a single session for every query run by this thread inside the with block,
+        instead of opening a new session per statement. Nested blocks share the session.
+        """
+        current = getattr(self.local, "session", None)
+        if current is not None:
+            yield current
+            return
+        with self.driver.session(fetch_size=self.fetch_size) as session:
+            self.local.session = session
+            try:
+                yield session
+            finally:
+                self.local.session = None
+
+    def execute_write(self, work, *args, **kwargs):
+        """
+        Run work(tx, *args, **kwargs) in a managed write transaction, retried by the
+        driver on transient errors.
+        """
+        with self.session() as session:
+            return session.execute_write(work, *args, **kwargs)
+
+    def execute_read(self, work, *args, **kwargs):
+        """
+        Run work(tx, *args, **kwargs) in a managed read transaction.
+        """
+        with self.session() as session:
+            return session.execute_read(work, *args, **kwargs)
+
+    def run_in_transaction(self, statements, write=True):
+        """
+        Executes several statements in one managed transaction, committed once.
+
+        :param statements: List of (query, parameters) tuples.
+        :param write: Use a write transaction, otherwise a read transaction.
+        :return: List with the records (as dictionaries) of each statement.
+        """
+
+        def work(tx):
+            return [
+                [record.data() for record in tx.run(query, parameters)]
+                for query, parameters in statements
+            ]
+
+        with metrics.timer("cypher_seconds", operation="transaction"):
+            return self.execute_write(work) if write else self.execute_read(work)
+
+    def run_many(self, query, rows, batch_size=1000):
+        """
+        Executes an UNWIND $rows query over rows in batches, one transaction per batch.
+
+        :param query: Cypher query reading its input from the $rows list.
+        :param rows: Iterable of dictionaries, consumed lazily.
+        :param batch_size: Number of rows sent per transaction.
+        :return: Number of rows sent.
+        """
+
+        def work(tx, batch):
+            tx.run(query, {"rows": batch}).consume()
+
+        rows = iter(rows)
+        total = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return total
+            with metrics.timer("cypher_seconds", operation="run_many"):
+                self.execute_write(work, batch)
+            total += len(batch)
+
     def run_query(self, query, parameters=None, single=False):
         """
         Executes a query on the Neo4j database.
@@ -16,9 +106,79 @@ class Neo4jConnector:
         :param single: If True, return a single record (converted to a dictionary).
         :return: Query result(s) as a dictionary or list of dictionaries.
         """
-        with self.driver.session() as session:
+        with self.session() as session, metrics.timer("cypher_seconds", operation="query"):
             result = session.run(query, parameters)
             if single:
                 record = result.single()
                 return record.data() if record else None
-            return [record.data() for record in result]
\ No newline at end of file
+            return [record.data() for record in result]
+
+    def run_auto_commit(self, query, parameters=None):
+        """
+        Executes a query in an auto-commit transaction, as required by
+        CALL { ... } IN TRANSACTIONS, and returns its summary counters.
+
+        :param query: Cypher query to execute.
+        :param parameters: Parameters for the query.
+        :return: Dictionary of the non-zero update counters (nodes_deleted, ...).
+        """
+        with self.session() as session, metrics.timer(
+            "cypher_seconds", operation="auto_commit"
+        ):
+            counters = session.run(query, parameters).consume().counters
+            return {
+                name: value
+                for name, value in vars(counters).items()
+                if isinstance(value, int) and not isinstance(value, bool) and value
+            }
+
+    def stream_query(self, query, parameters=None, fetch_size=None):
+        """
+        Executes a query and yields its records one by one as they are fetched.
+        The query always gets its own session so other queries can run meanwhile.
+
+        :param query: Cypher query to execute.
+        :param parameters: Parameters for the query.
+        :param fetch_size: Number of records pulled from the server at a time.
+        :return: Generator of records converted to dictionaries.
+        """
+        with self.driver.session(fetch_size=fetch_size or self.fetch_size) as session:
+            result = session.run(query, parameters)
+            for record in result:
+                yield record.data()
+
+    def iter_keyset(self, query, parameters=None, key="id", page_size=1000, start=""):
+        """
+        Iterates over a query page by page using keyset pagination, each page being a
+        short query so no transaction stays open while the records are processed.
+
+        :param query: Cypher query returning the records with a key greater than
+            $last_key, ordered by key and limited to $page_size records.
+        :param parameters: Other parameters for the query.
+        :param key: Name of the returned column holding the pagination key.
+        :param page_size: Number of records per page.
+        :param start: Key below all keys (the empty string for string ids such as Book.id).
+        :return: Generator of records converted to dictionaries.
+        """
+        parameters = dict(parameters or {})
+        last_key = start
+        while True:
+            page = self.run_query(
+                query, {**parameters, "last_key": last_key, "page_size": page_size}
+            )
+            if not page:
+                return
+            yield from page
+            last_key = page[-1][key]
+
+    def explain(self, query, parameters=None):
+        """
+        Plan a query with EXPLAIN without executing it.
+
+        :param query: Cypher query to plan.
+        :param parameters: Parameters for the query.
+        :return: The root operator of the query plan as a dictionary.
+        """
+        with self.session() as session:
+            result = session.run(f"EXPLAIN {query}", parameters)
+            return result.consume().plan
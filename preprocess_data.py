@@ -1,4 +1,132 @@
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Columns kept from the raw book files, read with explicit dtypes in the chunked mode
+BOOK_DTYPES = {
+    "Id": "string",
+    "Name": "string",
+    "Authors": "string",
+    "Rating": "float64",
+    "pagesNumber": "Int64",
+    "PublishYear": "Int64",
+    "PublishMonth": "Int64",
+    "PublishDay": "Int64",
+    "Publisher": "category",
+    "Language": "category",
+    "Description": "string",
+}
+
+RATING_DTYPES = {"ID": "string", "Name": "string", "Rating": "category"}
+
+
+def write_parquet(df, path):
+    """
+    Write df as one Parquet part, its categorical columns stored as plain strings: the
+    dictionary codes of a categorical get wider with its number of categories, so parts
+    of the same output would otherwise not share one schema.
+    """
+    categorical = {
+        column: "string"
+        for column, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+    df.astype(categorical).to_parquet(path, index=False)
+
+
+class DeduplicationIndex:
+    def __init__(self):
+        """
+        Hash-based index of the book ids and author names seen across all the shards of
+        an output, used to drop duplicate books and to give every author one canonical
+        spelling and a stable id.
+        """
+        self.seen_ids = set()
+        # normalized key -> canonical (first seen) spelling of the author
+        self.authors = {}
+        self.books = 0
+        self.duplicate_books = 0
+        self.author_mentions = 0
+        self.author_variants = 0
+
+    @staticmethod
+    def author_key(name):
+        """
+        Key under which spellings of the same author are merged: Unicode normalization,
+        case and whitespace are ignored.
+        """
+        return " ".join(unicodedata.normalize("NFKC", name).casefold().split())
+
+    @staticmethod
+    def author_id(key):
+        """
+        Stable id of an author, the same in every run and on every machine.
+        """
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def normalize_authors(self, authors):
+        """
+        Rewrite a ";" separated list of authors with their canonical spellings, without
+        duplicates.
+        """
+        names = []
+        for name in authors.split(";"):
+            key = self.author_key(name)
+            if not key:
+                continue
+            canonical = self.authors.get(key)
+            if canonical is None:
+                canonical = self.authors[key] = " ".join(name.split())
+            elif canonical != name.strip():
+                self.author_variants += 1
+            if canonical not in names:
+                names.append(canonical)
+        self.author_mentions += len(names)
+        return ";".join(names) or "Unknown Author"
+
+    def filter_books(self, df):
+        """
+        Drop the books whose Id was already seen (in this or a previous shard) and
+        normalize the authors of the others.
+        """
+        total = len(df)
+        df = df.drop_duplicates("Id")
+        df = df[~df["Id"].isin(self.seen_ids)]
+        self.seen_ids.update(df["Id"])
+        self.books += total
+        self.duplicate_books += total - len(df)
+        return df.assign(Authors=df["Authors"].map(self.normalize_authors))
+
+    def author_table(self):
+        """
+        Canonical author table with the stable id of every author.
+        """
+        return pd.DataFrame(
+            [(self.author_id(key), name) for key, name in self.authors.items()],
+            columns=["AuthorId", "Name"],
+        )
+
+    def report(self):
+        books_rate = self.duplicate_books / self.books if self.books else 0.0
+        variants_rate = (
+            self.author_variants / self.author_mentions if self.author_mentions else 0.0
+        )
+        logger.info(
+            f"{self.books} books read, {self.duplicate_books} duplicates dropped "
+            f"({books_rate:.1%}). {len(self.authors)} distinct authors in "
+            f"{self.author_mentions} mentions, {self.author_variants} spelling variants "
+            f"merged ({variants_rate:.1%})."
+        )
 
 
 class DataProcessor:
@@ -6,12 +134,30 @@ class DataProcessor:
         self.fileoutput = fileoutput
         self.df = None
         self.filename = None
+        self.part = None
+        self.index = DeduplicationIndex()
 
     def load_data(self):
         try:
             self.df = pd.read_csv(f"raw_data/{self.filename}.csv")
         except FileNotFoundError:
-            print("File not found")
+            logger.warning(f"File '{self.filename}' not found")
+
+    def load_chunks(self, dtypes, chunksize):
+        """
+        Stream the raw file in chunks of chunksize rows, parsing only the columns in
+        dtypes with their explicit types.
+        """
+        try:
+            return pd.read_csv(
+                f"raw_data/{self.filename}.csv",
+                usecols=lambda column: column in dtypes,
+                dtype=dtypes,
+                chunksize=chunksize,
+            )
+        except FileNotFoundError:
+            logger.warning(f"File '{self.filename}' not found")
+            return []
 
     def clean_book_data(self):
         if self.df is not None:
@@ -39,16 +185,21 @@ class DataProcessor:
                 [col for col in columns_to_keep if col in self.df.columns]
             ]
             # fill rows with missing values
-            self.df.fillna(
-                {
-                    "Authors": "Unknown Author",
-                    "Publisher": "Unknown Publisher",
-                    "Language": "Unknown Language",
-                },
-                inplace=True,
-            )
+            fill_values = {
+                "Authors": "Unknown Author",
+                "Publisher": "Unknown Publisher",
+                "Language": "Unknown Language",
+            }
+            for column, value in fill_values.items():
+                # categorical columns (chunked mode) only accept known categories
+                if column in self.df.columns and isinstance(
+                    self.df[column].dtype, pd.CategoricalDtype
+                ):
+                    if value not in self.df[column].cat.categories:
+                        self.df[column] = self.df[column].cat.add_categories([value])
+            self.df.fillna(fill_values, inplace=True)
         else:
-            print("Dataframe is not loaded")
+            logger.warning("Dataframe is not loaded")
 
     def clean_rating_data(self):
         if self.df is not None:
@@ -66,7 +217,7 @@ class DataProcessor:
             self.df["NumericalRating"] = self.df["Rating"].map(rating_map)
 
         else:
-            print("Dataframe is not loaded")
+            logger.warning("Dataframe is not loaded")
 
     def save_data(self):
         if self.df is not None:
@@ -78,7 +229,31 @@ class DataProcessor:
                 is_empty = True
             self.df.to_csv(file_path, mode="a", header=is_empty, index=False)
         else:
-            print("Dataframe is not loaded")
+            logger.warning("Dataframe is not loaded")
+
+    def save_parquet(self):
+        """
+        Write the current dataframe as the next part of the partitioned Parquet output
+        processed_data/<fileoutput>/part-*.parquet.
+        """
+        if self.df is not None:
+            write_parquet(self.df, self.next_part())
+        else:
+            logger.warning("Dataframe is not loaded")
+
+    def next_part(self):
+        """
+        Path of the next part of the partitioned Parquet output.
+        """
+        directory = f"processed_data/{self.fileoutput}"
+        if self.part is None:
+            os.makedirs(directory, exist_ok=True)
+            self.part = len(
+                [name for name in os.listdir(directory) if name.endswith(".parquet")]
+            )
+        path = f"{directory}/part-{self.part:05d}.parquet"
+        self.part += 1
+        return path
 
     # reset fileoutput data
     def reset_data(self):
@@ -87,7 +262,20 @@ class DataProcessor:
             with open(file_path, "w") as f:
                 f.truncate()
         except FileNotFoundError:
-            print("File not found")
+            logger.warning(f"File '{file_path}' not found")
+        shutil.rmtree(f"processed_data/{self.fileoutput}", ignore_errors=True)
+        self.part = None
+        self.index = DeduplicationIndex()
+
+    def save_authors(self):
+        """
+        Write the canonical author table of the books processed so far to
+        processed_data/<fileoutput>-authors.csv and report the duplicate rates.
+        """
+        self.index.author_table().to_csv(
+            f"processed_data/{self.fileoutput}-authors.csv", index=False
+        )
+        self.index.report()
 
     def process_books(self, filename):
         self.filename = filename
@@ -100,3 +288,161 @@ class DataProcessor:
         self.load_data()
         self.clean_rating_data()
         self.save_data()
+
+    def clean_chunks(self, kind, chunksize):
+        """
+        Yield the cleaned chunks of the current raw file, kind being "books" or "ratings".
+        """
+        dtypes = BOOK_DTYPES if kind == "books" else RATING_DTYPES
+        for chunk in self.load_chunks(dtypes, chunksize):
+            self.df = chunk
+            if kind == "books":
+                self.clean_book_data()
+            else:
+                self.clean_rating_data()
+                # mapped from a categorical column, store it as a plain nullable integer
+                self.df["NumericalRating"] = self.df["NumericalRating"].astype("Int64")
+            yield self.df
+
+    def process_books_chunked(self, filename, chunksize=100000):
+        """
+        Clean a raw books file chunk by chunk into the partitioned Parquet output, so that
+        peak memory depends on chunksize instead of the file size.
+        """
+        self.filename = filename
+        start = time.perf_counter()
+        rows = 0
+        for chunk in self.clean_chunks("books", chunksize):
+            self.df = self.index.filter_books(chunk)
+            self.save_parquet()
+            rows += len(self.df)
+        logger.info(
+            f"Processed {rows} books of '{filename}' in {time.perf_counter() - start:.2f}s."
+        )
+
+    def process_ratings_chunked(self, filename, chunksize=100000):
+        """
+        Clean a raw ratings file chunk by chunk into the partitioned Parquet output.
+        """
+        self.filename = filename
+        start = time.perf_counter()
+        rows = 0
+        for chunk in self.clean_chunks("ratings", chunksize):
+            self.save_parquet()
+            rows += len(chunk)
+        logger.info(
+            f"Processed {rows} ratings of '{filename}' in {time.perf_counter() - start:.2f}s."
+        )
+
+    def process_parallel(
+        self, kind, filenames, workers=None, chunksize=100000, parquet=True
+    ):
+        """
+        Clean many raw shards concurrently in a process pool and append them to the output
+        in the order of filenames, so the result does not depend on which shard finishes
+        first. Books are deduplicated by Id, keeping the first occurrence across shards and
+        previous calls, and their authors normalized (see DeduplicationIndex).
+
+        Each worker writes its cleaned chunks as Parquet files to a staging directory and
+        only returns their paths, and at most twice as many shards as workers are in
+        flight, so memory is bounded by chunksize rather than by the shard size.
+
+        :param kind: "books" or "ratings".
+        :param filenames: Raw shards to process, without the .csv extension.
+        :param workers: Number of processes, defaults to the number of CPUs.
+        :param chunksize: Rows parsed at a time inside each worker.
+        :param parquet: Write the partitioned Parquet output, otherwise the CSV (whose
+            header is written once, by the first shard).
+        """
+        start = time.perf_counter()
+        rows = 0
+        staging = f"processed_data/{self.fileoutput}.staging"
+        shutil.rmtree(staging, ignore_errors=True)
+        shards = iter(enumerate(filenames))
+        in_flight = 2 * (workers or os.cpu_count() or 1)
+        pending = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                while True:
+                    submit = in_flight - len(pending)
+                    for index, filename in itertools.islice(shards, submit):
+                        directory = f"{staging}/shard-{index:05d}"
+                        future = executor.submit(
+                            clean_shard, kind, filename, chunksize, directory
+                        )
+                        pending.append((filename, future))
+                    if not pending:
+                        break
+                    # shards are appended in order, whatever order they finish in
+                    filename, future = pending.popleft()
+                    parts, cleaned, elapsed = future.result()
+                    if not parts:
+                        logger.info(f"Skipped '{filename}', no data.")
+                        continue
+                    written = self.append_parts(kind, parts, parquet)
+                    metrics.observe("shard_clean_seconds", elapsed, kind=kind)
+                    metrics.inc("preprocessed_rows_total", written, kind=kind)
+                    rows += written
+                    logger.info(
+                        f"Cleaned '{filename}' in {elapsed:.2f}s: {cleaned} {kind}, "
+                        f"{cleaned - written} duplicates dropped."
+                    )
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info(
+            f"Processed {rows} {kind} from {len(filenames)} shards in "
+            f"{time.perf_counter() - start:.2f}s."
+        )
+
+    def append_parts(self, kind, parts, parquet):
+        """
+        Append the staged Parquet parts of one shard, (path, rows) pairs, to the output
+        and return the number of rows written. Ratings parts are moved into the Parquet
+        output as they are, books parts are read one at a time to be deduplicated.
+        """
+        written = 0
+        for path, rows in parts:
+            if kind == "ratings" and parquet:
+                os.replace(path, self.next_part())
+                written += rows
+                continue
+            self.df = pd.read_parquet(path)
+            if kind == "books":
+                self.df = self.index.filter_books(self.df)
+            if parquet:
+                self.save_parquet()
+            else:
+                self.save_data()
+            written += len(self.df)
+            os.remove(path)
+        return written
+
+    def process_books_parallel(
+        self, filenames, workers=None, chunksize=100000, parquet=True
+    ):
+        self.process_parallel("books", filenames, workers, chunksize, parquet)
+
+    def process_ratings_parallel(
+        self, filenames, workers=None, chunksize=100000, parquet=True
+    ):
+        self.process_parallel("ratings", filenames, workers, chunksize, parquet)
+
+
+def clean_shard(kind, filename, chunksize, directory):
+    """
+    Clean one raw shard in a worker process, writing every cleaned chunk to
+    directory/part-*.parquet, and return (parts, rows, elapsed seconds), parts being the
+    (path, rows) pairs of the chunks, empty when the shard is missing or empty.
+    """
+    start = time.perf_counter()
+    processor = DataProcessor(fileoutput=None)
+    processor.filename = filename
+    parts = []
+    for chunk in processor.clean_chunks(kind, chunksize):
+        if chunk.empty:
+            continue
+        os.makedirs(directory, exist_ok=True)
+        path = f"{directory}/part-{len(parts):05d}.parquet"
+        write_parquet(chunk, path)
+        parts.append((path, len(chunk)))
+    return parts, sum(rows for _, rows in parts), time.perf_counter() - start
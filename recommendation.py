@@ -0,0 +1,271 @@
+import functools
+import itertools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+from define_kg import parse_number
+from metrics import ProgressReporter, metrics
+from neo4j_manager import Neo4jConnector
+from similarity_engine import block_top_k
+
+logger = logging.getLogger(__name__)
+
+# Item vectors of a worker process and their transpose, set once by init_worker
+worker_items = None
+worker_items_t = None
+
+
+def init_worker(items):
+    global worker_items, worker_items_t
+    worker_items = items
+    worker_items_t = items.T.tocsr()
+
+
+def similar_items_block(start, end, k, min_score):
+    """
+    Top-k similar items of the items start to end, in a worker process.
+    """
+    return block_top_k(worker_items[start:end], worker_items_t, start, k, min_score)
+
+
+class RecommendationEngine:
+    def __init__(
+        self,
+        neo4j_uri,
+        neo4j_user,
+        neo4j_password,
+        top_k=20,
+        min_score=0.05,
+        block_size=1024,
+        workers=None,
+        cache_size=10000,
+    ):
+        """
+        Item-based collaborative filtering over the REVIEWED_BY ratings: the ratings are
+        loaded once into a sparse user x book matrix, the top_k most similar books of
+        every book (adjusted cosine, at least min_score) are precomputed in blocks of
+        block_size books by a pool of workers processes, and recommendations are then
+        served from memory, the last cache_size answers being cached.
+        """
+        self.db = Neo4jConnector(neo4j_uri, neo4j_user, neo4j_password)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.block_size = block_size
+        self.workers = workers
+        self.user_ids = []
+        self.user_index = {}
+        self.book_ids = []
+        self.book_index = {}
+        # mean-centered ratings, users x books
+        self.ratings = None
+        # top_k similarity scores of every book, books x books, and their absolute values
+        self.similar = None
+        self.similar_abs = None
+        # most rated books first, recommended to unknown users
+        self.popular = []
+        self.cached_recommend = functools.lru_cache(maxsize=cache_size)(
+            self.compute_recommendations
+        )
+
+    def load_ratings(self):
+        """
+        Read every numerical rating of the graph into the ratings matrix, averaging the
+        ratings of a user given several times to a book and centering each user's
+        ratings on their mean.
+        """
+        start = time.perf_counter()
+        users, books, values = [], [], []
+        records = self.db.stream_query(
+            """
+            MATCH (b:Book)-[r:REVIEWED_BY]->(u:User)
+            WHERE r.num_rating IS NOT NULL
+            RETURN u.id AS user_id, b.id AS book_id, r.num_rating AS rating
+            """,
+            fetch_size=10000,
+        )
+        for record in records:
+            # ratings imported from the CSV output are empty strings when not numerical
+            rating = parse_number(record["rating"], float)
+            if rating is None:
+                continue
+            user = self.user_index.get(record["user_id"])
+            if user is None:
+                user = self.user_index[record["user_id"]] = len(self.user_ids)
+                self.user_ids.append(record["user_id"])
+            book = self.book_index.get(record["book_id"])
+            if book is None:
+                book = self.book_index[record["book_id"]] = len(self.book_ids)
+                self.book_ids.append(record["book_id"])
+            users.append(user)
+            books.append(book)
+            values.append(rating)
+        shape = (len(self.user_ids), len(self.book_ids))
+        users = np.array(users, dtype=np.int32)
+        books = np.array(books, dtype=np.int32)
+        totals = sparse.csr_matrix(
+            (np.array(values, dtype=np.float32), (users, books)), shape=shape
+        )
+        counts = sparse.csr_matrix(
+            (np.ones(len(values), dtype=np.float32), (users, books)), shape=shape
+        )
+        # both matrices have the same sorted structure once duplicates are summed
+        ratings = totals.copy()
+        ratings.data = totals.data / counts.data
+        per_user = np.diff(ratings.indptr)
+        means = np.asarray(ratings.sum(axis=1)).ravel() / np.maximum(per_user, 1)
+        ratings.data -= np.repeat(means, per_user).astype(np.float32)
+        self.ratings = ratings
+        rating_counts = np.diff(ratings.tocsc().indptr)
+        self.popular = [
+            self.book_ids[book] for book in np.argsort(-rating_counts, kind="stable")
+        ]
+        logger.info(
+            f"Loaded {ratings.nnz} ratings of {shape[0]} users on {shape[1]} books "
+            f"in {time.perf_counter() - start:.2f}s."
+        )
+
+    def item_vectors(self):
+        """
+        L2-normalized rating vectors of the books, books x users.
+        """
+        items = self.ratings.T.tocsr()
+        norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return (sparse.diags((1 / norms).astype(np.float32)) @ items).tocsr()
+
+    def compute_similar_items(self):
+        """
+        Top-k most similar books of every book, one block of block_size books per task.
+        """
+        items = self.item_vectors()
+        count = items.shape[0]
+        starts = list(range(0, count, self.block_size))
+        ends = [min(start + self.block_size, count) for start in starts]
+        progress = ProgressReporter("Item similarity", total=count, unit="books")
+        tasks = (starts, ends, [self.top_k] * len(starts), [self.min_score] * len(starts))
+        executor = None
+        if self.workers == 1:
+            init_worker(items)
+            blocks = map(similar_items_block, *tasks)
+        else:
+            # the item vectors are sent once to each worker, not with every block
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=init_worker, initargs=(items,)
+            )
+            blocks = executor.map(similar_items_block, *tasks)
+        found = []
+        try:
+            for start, end, block in zip(starts, ends, blocks):
+                found.append(block)
+                progress.update(end - start)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        progress.finish()
+        if found:
+            rows, cols, scores = (np.concatenate(arrays) for arrays in zip(*found))
+        else:
+            rows = cols = np.array([], dtype=np.int64)
+            scores = np.array([], dtype=np.float32)
+        self.similar = sparse.csr_matrix((scores, (rows, cols)), shape=(count, count))
+        self.similar_abs = abs(self.similar)
+
+    def build(self):
+        """
+        Load the ratings and precompute the similar books, dropping cached answers.
+        """
+        self.user_ids, self.user_index, self.book_ids, self.book_index = [], {}, [], {}
+        with metrics.timer("recommendation_seconds", step="load"):
+            self.load_ratings()
+        with metrics.timer("recommendation_seconds", step="similarity"):
+            self.compute_similar_items()
+        self.cached_recommend.cache_clear()
+
+    def compute_recommendations(self, user_id, k):
+        user = self.user_index.get(user_id)
+        if user is None:
+            # nothing is known about the user, recommend the most rated books
+            return tuple((book_id, 0.0) for book_id in self.popular[:k])
+        ratings = self.ratings[user]
+        if not ratings.data.any():
+            # ratings all equal to the user's mean (a single rating, or the same rating
+            # everywhere) tell no preference, recommend the most rated unrated books
+            rated = set(ratings.indices.tolist())
+            books = (
+                book_id
+                for book_id in self.popular
+                if self.book_index[book_id] not in rated
+            )
+            return tuple((book_id, 0.0) for book_id in itertools.islice(books, k))
+        rated = ratings.copy()
+        rated.data = np.ones_like(rated.data)
+        # average of the user's centered ratings weighted by the similarity of each
+        # rated book to the candidate books
+        weights = (ratings @ self.similar).tocsr()
+        weights.sort_indices()
+        norms = (rated @ self.similar_abs).tocsr()
+        norms.sort_indices()
+        books = weights.indices
+        scores = weights.data / norms.data[np.searchsorted(norms.indices, books)]
+        keep = (scores > 0) & ~np.isin(books, ratings.indices)
+        books, scores = books[keep], scores[keep]
+        order = np.argsort(-scores, kind="stable")[:k]
+        return tuple(
+            (self.book_ids[book], float(score))
+            for book, score in zip(books[order].tolist(), scores[order].tolist())
+        )
+
+    def recommend(self, user_id, k=10):
+        """
+        Up to k (book id, score) pairs of unrated books predicted to please the user, the
+        score being the predicted deviation from the user's mean rating. Unknown users,
+        and users whose ratings are all the same, get the most rated books with a score
+        of 0.
+        """
+        if self.similar is None:
+            raise RuntimeError("Call build() before asking for recommendations.")
+        start = time.perf_counter()
+        recommendations = list(self.cached_recommend(user_id, k))
+        metrics.observe("recommendation_request_seconds", time.perf_counter() - start)
+        return recommendations
+
+    def write_similar_edges(self, batch_size=10000):
+        """
+        Replace the CO_RATED_SIMILAR {score} relationships with the precomputed ones.
+        """
+        counters = self.db.run_auto_commit(
+            f"""
+            MATCH ()-[r:CO_RATED_SIMILAR]->()
+            CALL {{ WITH r DELETE r }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+            """
+        )
+        deleted = counters.get("relationships_deleted", 0)
+        logger.info(f"Deleted {deleted} CO_RATED_SIMILAR relationships.")
+        similar = self.similar.tocoo()
+        edges = (
+            {
+                "book_id": self.book_ids[row],
+                "similar_id": self.book_ids[col],
+                "score": score,
+            }
+            for row, col, score in zip(
+                similar.row.tolist(), similar.col.tolist(), similar.data.tolist()
+            )
+        )
+        with metrics.timer("batch_write_seconds", stage="co_rated_similar"):
+            written = self.db.run_many(
+                """
+                UNWIND $rows AS row
+                MATCH (b:Book {id: row.book_id}), (s:Book {id: row.similar_id})
+                CREATE (b)-[:CO_RATED_SIMILAR {score: row.score}]->(s)
+                """,
+                edges,
+                batch_size,
+            )
+        metrics.inc("co_rated_similar_edges_total", written)
+        logger.info(f"Wrote {written} CO_RATED_SIMILAR relationships.")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,210 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheMissError(Exception):
+    """
+    Raised by a read-only cache when a response is not cached.
+    """
+
+
+class ResponseCache:
+    def __init__(
+        self, path, ttl_seconds=None, max_entries=None, read_only=False, memory_entries=0
+    ):
+        """
+        Disk-backed key/value cache for remote responses, stored in a SQLite file.
+
+        :param path: SQLite file holding the cache.
+        :param ttl_seconds: Default lifetime of an entry, None to keep entries forever.
+        :param max_entries: Once exceeded, the least recently used entries are evicted.
+        :param read_only: Replay mode, nothing is written and misses raise CacheMissError
+            in the callers so that no request goes over the network.
+        :param memory_entries: Size of an in-memory LRU tier in front of the SQLite file,
+            for responses looked up many times in a run (0 disables it).
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Content-address a request by hashing its parts (e.g. model name and prompt).
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[1] is None or entry[1] >= now:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return entry[0]
+                del self.memory[key]
+            row = self.connection.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.remember(key, row[0], row[1])
+            if not self.read_only:
+                self.connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self.connection.commit()
+            return row[0]
+
+    def remember(self, key, value, expires_at):
+        """
+        Put an entry in the in-memory tier, dropping its least recently used entries.
+        Called with the lock held.
+        """
+        if not self.memory_entries:
+            return
+        self.memory[key] = (value, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def set(self, key, value, ttl_seconds=None):
+        """
+        Store value under key, expiring after ttl_seconds (defaults to the cache TTL).
+        """
+        if self.read_only:
+            return
+        if ttl_seconds is None:
+            ttl_seconds = self.ttl_seconds
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds is not None else None
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self.connection.commit()
+            self.remember(key, value, expires_at)
+            self.writes += 1
+            evict = self.max_entries is not None and self.writes % 1000 == 0
+        if evict:
+            self.evict()
+
+    def prewarm(self, source_path=None):
+        """
+        Import the unexpired entries of a previous run's cache file (if source_path is
+        given, existing entries win), then load the most recently used entries into the
+        in-memory tier. Return the number of imported entries.
+        """
+        imported = 0
+        with self.lock:
+            if source_path is not None and not self.read_only:
+                self.connection.execute("ATTACH DATABASE ? AS previous", (source_path,))
+                try:
+                    imported = self.connection.execute(
+                        """
+                        INSERT OR IGNORE INTO responses
+                        SELECT key, value, expires_at, accessed_at FROM previous.responses
+                        WHERE expires_at IS NULL OR expires_at >= ?
+                        """,
+                        (time.time(),),
+                    ).rowcount
+                    self.connection.commit()
+                finally:
+                    self.connection.execute("DETACH DATABASE previous")
+            if self.memory_entries:
+                rows = self.connection.execute(
+                    """
+                    SELECT key, value, expires_at FROM responses
+                    WHERE expires_at IS NULL OR expires_at >= ?
+                    ORDER BY accessed_at DESC LIMIT ?
+                    """,
+                    (time.time(), self.memory_entries),
+                ).fetchall()
+                for key, value, expires_at in reversed(rows):
+                    self.remember(key, value, expires_at)
+        return imported
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones above max_entries.
+        """
+        if self.read_only:
+            return 0
+        with self.lock:
+            removed = self.connection.execute(
+                "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (time.time(),),
+            ).rowcount
+            if self.max_entries is not None:
+                removed += self.connection.execute(
+                    """
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY accessed_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                ).rowcount
+            self.connection.commit()
+        return removed
+
+    def stats(self):
+        """
+        Hit/miss counters and size of the cache.
+        """
+        with self.lock:
+            entries = self.connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        self.evict()
+        self.connection.close()
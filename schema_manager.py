@@ -0,0 +1,123 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaManager:
+    # (name, label, property) of every uniqueness constraint the pipeline MERGEs on
+    CONSTRAINTS = [
+        ("book_id_unique", "Book", "id"),
+        ("author_name_unique", "Author", "name"),
+        ("user_id_unique", "User", "id"),
+        ("genre_name_unique", "Genre", "name"),
+        ("subject_uri_unique", "Subject", "uri"),
+        ("adaptation_uri_unique", "Adaptation", "uri"),
+    ]
+
+    # (name, label, property) of the range indexes used by lookups on non-key properties
+    INDEXES = [
+        ("book_name_index", "Book", "name"),
+    ]
+
+    # Representative lookups issued by the pipeline, used to check index usage
+    PIPELINE_QUERIES = {
+        "merge_book": (
+            "MERGE (b:Book {id: $id}) RETURN b",
+            {"id": "1"},
+        ),
+        "merge_author": (
+            "MERGE (a:Author {name: $name}) RETURN a",
+            {"name": "Unknown Author"},
+        ),
+        "merge_user": (
+            "MERGE (u:User {id: $id}) RETURN u",
+            {"id": "1"},
+        ),
+        "match_book_by_name": (
+            "MATCH (b:Book {name: $title}) RETURN b.id AS id",
+            {"title": "Unknown"},
+        ),
+        "merge_genre": (
+            "MERGE (g:Genre {name: $genre}) RETURN g",
+            {"genre": "Unknown"},
+        ),
+        "merge_subject": (
+            "MERGE (s:Subject {uri: $subject}) RETURN s",
+            {"subject": "http://dbpedia.org/resource/Unknown"},
+        ),
+        "merge_adaptation": (
+            "MERGE (a:Adaptation {uri: $adaptation}) RETURN a",
+            {"adaptation": "http://dbpedia.org/resource/Unknown"},
+        ),
+    }
+
+    def __init__(self, db):
+        """
+        Initialize the schema manager with a connected Neo4jConnector.
+        """
+        self.db = db
+
+    def create_schema(self, wait_timeout=300):
+        """
+        Idempotently create the constraints and indexes, then wait for them to come online.
+        """
+        for name, label, prop in self.CONSTRAINTS:
+            self.db.run_query(
+                f"CREATE CONSTRAINT {name} IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE"
+            )
+        for name, label, prop in self.INDEXES:
+            self.db.run_query(
+                f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})"
+            )
+        self.wait_for_indexes(wait_timeout)
+        logger.info(
+            f"Schema ready: {len(self.CONSTRAINTS)} constraints, {len(self.INDEXES)} indexes."
+        )
+
+    def wait_for_indexes(self, timeout=300):
+        """
+        Block until every index is online, or until timeout seconds have passed.
+        """
+        self.db.run_query("CALL db.awaitIndexes($timeout)", {"timeout": timeout})
+        pending = self.db.run_query(
+            "SHOW INDEXES YIELD name, state WHERE state <> 'ONLINE' RETURN name, state"
+        )
+        for index in pending:
+            logger.info(f"Index '{index['name']}' is still {index['state']}.")
+        return not pending
+
+    def explain_index_usage(self, queries=None):
+        """
+        Plan each query with EXPLAIN and report the index seeks and label scans it uses.
+
+        :param queries: Mapping of name to (query, parameters), defaults to PIPELINE_QUERIES.
+        :return: Mapping of name to a list of (operator, details) tuples.
+        """
+        if queries is None:
+            queries = self.PIPELINE_QUERIES
+        report = {}
+        for name, (query, parameters) in queries.items():
+            plan = self.db.explain(query, parameters)
+            operators = self.collect_lookup_operators(plan)
+            report[name] = operators
+            if not operators:
+                logger.info(f"{name}: no index or scan operator in plan.")
+            for operator, details in operators:
+                logger.info(f"{name}: {operator} {details}")
+        return report
+
+    def collect_lookup_operators(self, plan):
+        """
+        Walk a query plan and collect the operators that read nodes through an index or scan.
+        """
+        operators = []
+        stack = [plan]
+        while stack:
+            operator = stack.pop()
+            operator_type = operator.get("operatorType", "")
+            if "Index" in operator_type or "Scan" in operator_type:
+                details = operator.get("args", {}).get("Details", "")
+                operators.append((operator_type.split("@")[0], details))
+            stack.extend(operator.get("children", []))
+        return operators
@@ -0,0 +1,288 @@
+import logging
+import re
+import time
+import zlib
+from array import array
+import numpy as np
+from scipy import sparse
+from metrics import ProgressReporter, metrics
+from neo4j_manager import Neo4jConnector
+
+logger = logging.getLogger(__name__)
+
+# Words of at least two letters, digits and punctuation are dropped
+TOKEN = re.compile(r"[^\W\d_]{2,}")
+
+
+def tokenize(text):
+    return TOKEN.findall(text.casefold()) if text else []
+
+
+def top_k_pairs(rows, cols, scores, k):
+    """
+    Keep the k best scored (row, col) pairs of every row, ordered by row then score.
+    """
+    if not len(rows):
+        return rows, cols, scores
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    # rank of each pair within its row
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    sizes = np.diff(np.r_[starts, len(rows)])
+    rank = np.arange(len(rows)) - np.repeat(starts, sizes)
+    keep = rank < k
+    return rows[keep], cols[keep], scores[keep]
+
+
+def block_top_k(block, matrix_t, offset, k, min_score=0.0):
+    """
+    Top-k columns of every row of block @ matrix_t scoring at least min_score, the
+    rows of block being the rows offset, offset + 1, ... of the matrix whose transpose
+    is matrix_t (a row is never its own neighbour).
+
+    :return: Arrays of the matrix rows, neighbour columns and scores.
+    """
+    products = (block @ matrix_t).tocoo()
+    rows = products.row.astype(np.int64) + offset
+    cols = products.col.astype(np.int64)
+    keep = (cols != rows) & (products.data >= min_score) & (products.data > 0)
+    return top_k_pairs(rows[keep], cols[keep], products.data[keep], k)
+
+
+def blocked_top_k(matrix, k, block_size=1024, min_score=0.0):
+    """
+    Exact top-k most similar rows of every row of a row-normalized sparse matrix, with
+    one sparse matrix product per block of block_size rows so that memory stays bounded.
+
+    :return: Generator of (rows, cols, scores) arrays, one per block.
+    """
+    matrix_t = matrix.T.tocsr()
+    for start in range(0, matrix.shape[0], block_size):
+        yield block_top_k(
+            matrix[start : start + block_size], matrix_t, start, k, min_score
+        )
+
+
+def lsh_top_k(
+    matrix, k, tables=4, bits=16, max_bucket_size=2000, min_score=0.0, seed=0
+):
+    """
+    Approximate top-k most similar rows of every row of a row-normalized sparse matrix.
+    Rows are hashed by random hyperplanes (cosine LSH) into 2^bits buckets in each of
+    tables tables, and only rows sharing a bucket are compared, buckets larger than
+    max_bucket_size being compared by slices.
+
+    :return: Arrays of the rows, neighbour columns and scores.
+    """
+    rng = np.random.default_rng(seed)
+    powers = np.left_shift(1, np.arange(bits, dtype=np.int64))
+    found = []
+    for _ in range(tables):
+        planes = rng.standard_normal((matrix.shape[1], bits), dtype=np.float32)
+        codes = (np.asarray(matrix @ planes) > 0).astype(np.int64) @ powers
+        order = np.argsort(codes, kind="stable")
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        for bucket in np.split(order, boundaries):
+            for start in range(0, len(bucket), max_bucket_size):
+                members = bucket[start : start + max_bucket_size]
+                if len(members) < 2:
+                    continue
+                vectors = matrix[members]
+                scores = (vectors @ vectors.T).toarray()
+                np.fill_diagonal(scores, 0)
+                rows, cols = np.nonzero((scores >= min_score) & (scores > 0))
+                found.append(
+                    top_k_pairs(members[rows], members[cols], scores[rows, cols], k)
+                )
+    if not found:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float32)
+    rows, cols, scores = (np.concatenate(arrays) for arrays in zip(*found))
+    # a pair found in several tables is kept once
+    _, unique = np.unique(rows * matrix.shape[0] + cols, return_index=True)
+    return top_k_pairs(rows[unique], cols[unique], scores[unique], k)
+
+
+class SimilarityEngine:
+    # Weight of each field in the book vectors
+    FIELD_WEIGHTS = {"name": 2.0, "description": 1.0, "authors": 1.0}
+
+    def __init__(
+        self,
+        neo4j_uri,
+        neo4j_user,
+        neo4j_password,
+        top_k=10,
+        min_score=0.1,
+        n_features=2**18,
+        max_df=0.5,
+        block_size=1024,
+        lsh_tables=0,
+        lsh_bits=16,
+    ):
+        """
+        Build SIMILAR_TO relationships between the books with similar content, locally
+        and without any API call: books are embedded as hashed TF-IDF vectors of their
+        name, description and authors, and linked to their top_k nearest neighbours by
+        cosine similarity (at least min_score).
+
+        :param n_features: Size of the hashed feature space.
+        :param max_df: Features found in more than this share of the books are ignored.
+        :param block_size: Books compared per sparse matrix product in exact mode.
+        :param lsh_tables: Use that many LSH tables of lsh_bits bits to compare only
+            candidate books (approximate, for millions of books), 0 compares all books.
+        """
+        self.db = Neo4jConnector(neo4j_uri, neo4j_user, neo4j_password)
+        self.top_k = top_k
+        self.min_score = min_score
+        self.n_features = n_features
+        self.max_df = max_df
+        self.block_size = block_size
+        self.lsh_tables = lsh_tables
+        self.lsh_bits = lsh_bits
+
+    def iter_books(self, page_size=10000):
+        return self.db.iter_keyset(
+            """
+            MATCH (b:Book)
+            WHERE b.id > $last_key
+            WITH b ORDER BY b.id LIMIT $page_size
+            OPTIONAL MATCH (b)-[:`WRITTEN_BY`]->(a:Author)
+            WITH b, collect(a.name) AS authors
+            RETURN b.id AS id, b.name AS name, b.description AS description, authors
+            ORDER BY id
+            """,
+            page_size=page_size,
+        )
+
+    def feature(self, token, features):
+        index = features.get(token)
+        if index is None:
+            index = features[token] = zlib.crc32(token.encode("utf-8")) % self.n_features
+        return index
+
+    def field_matrix(self, indices, indptr):
+        """
+        Sublinear term frequencies (1 + log(tf)) of one field of every book.
+        """
+        indices = np.array(indices, dtype=np.int32)
+        indptr = np.array(indptr, dtype=np.int32)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(indptr) - 1, self.n_features),
+        )
+        matrix.sum_duplicates()
+        matrix.data = 1 + np.log(matrix.data)
+        return matrix
+
+    def vectorize(self, books):
+        """
+        Embed books as L2-normalized hashed TF-IDF vectors.
+
+        :return: The list of the book ids and the CSR matrix of their vectors.
+        """
+        ids = []
+        # hashed feature index of each token, per field, and the offsets of each book
+        fields = {field: (array("i"), array("i", [0])) for field in self.FIELD_WEIGHTS}
+        features = {}
+        for book in books:
+            ids.append(book["id"])
+            tokens = {
+                "name": tokenize(book["name"]),
+                "description": tokenize(book["description"]),
+                "authors": [
+                    "author:" + " ".join(author.casefold().split())
+                    for author in book["authors"] or []
+                ],
+            }
+            for field, (indices, indptr) in fields.items():
+                indices.extend(self.feature(token, features) for token in tokens[field])
+                indptr.append(len(indices))
+        if not ids:
+            return ids, sparse.csr_matrix((0, self.n_features), dtype=np.float32)
+        matrix = sum(
+            self.FIELD_WEIGHTS[field] * self.field_matrix(indices, indptr)
+            for field, (indices, indptr) in fields.items()
+        ).tocsr()
+        # inverse document frequencies, features found in too many books are dropped
+        document_frequency = np.bincount(matrix.indices, minlength=self.n_features)
+        idf = np.log((1 + len(ids)) / (1 + document_frequency)) + 1
+        idf[document_frequency > self.max_df * len(ids)] = 0
+        matrix.data *= idf[matrix.indices].astype(np.float32)
+        matrix.eliminate_zeros()
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return ids, (sparse.diags((1 / norms).astype(np.float32)) @ matrix).tocsr()
+
+    def remove_similarity_edges(self, batch_size=10000):
+        """
+        Delete the SIMILAR_TO relationships of a previous run, keeping those of the LLM.
+        """
+        counters = self.db.run_auto_commit(
+            f"""
+            MATCH ()-[r:SIMILAR_TO]->()
+            WHERE r.source = "content"
+            CALL {{ WITH r DELETE r }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+            """
+        )
+        deleted = counters.get("relationships_deleted", 0)
+        logger.info(f"Deleted {deleted} content SIMILAR_TO relationships.")
+
+    def write_edges(self, ids, rows, cols, scores, batch_size=10000):
+        """
+        Write the (rows, cols, scores) neighbours as SIMILAR_TO {score} relationships.
+        """
+        edges = (
+            {"book_id": ids[row], "similar_id": ids[col], "score": score}
+            for row, col, score in zip(rows.tolist(), cols.tolist(), scores.tolist())
+        )
+        return self.db.run_many(
+            """
+            UNWIND $rows AS row
+            MATCH (b:Book {id: row.book_id}), (s:Book {id: row.similar_id})
+            CREATE (b)-[:SIMILAR_TO {score: row.score, source: "content"}]->(s)
+            """,
+            edges,
+            batch_size,
+        )
+
+    def build_similarity_graph(self, batch_size=10000, page_size=10000):
+        """
+        Replace the content SIMILAR_TO relationships of the graph with freshly computed
+        ones, written batch_size at a time.
+        """
+        start = time.perf_counter()
+        self.remove_similarity_edges(batch_size)
+        with metrics.timer("similarity_seconds", step="vectorize"):
+            ids, matrix = self.vectorize(self.iter_books(page_size))
+        if not ids:
+            logger.info("No books to compare.")
+            return
+        logger.info(
+            f"Vectorized {len(ids)} books into {matrix.nnz} non-zero features "
+            f"in {time.perf_counter() - start:.2f}s."
+        )
+        if self.lsh_tables:
+            with metrics.timer("similarity_seconds", step="lsh"):
+                neighbours = [
+                    lsh_top_k(
+                        matrix,
+                        self.top_k,
+                        tables=self.lsh_tables,
+                        bits=self.lsh_bits,
+                        min_score=self.min_score,
+                    )
+                ]
+        else:
+            neighbours = blocked_top_k(
+                matrix, self.top_k, self.block_size, self.min_score
+            )
+        progress = ProgressReporter("Similarity", unit="edges")
+        for rows, cols, scores in neighbours:
+            with metrics.timer("batch_write_seconds", stage="similarity"):
+                progress.update(self.write_edges(ids, rows, cols, scores, batch_size))
+        metrics.inc("similarity_edges_total", progress.done)
+        progress.finish(books=len(ids))
+
+    def close(self):
+        self.db.close()
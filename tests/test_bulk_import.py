@@ -0,0 +1,47 @@
+import os
+import pytest
+from bulk_import import BulkImportExporter
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+EXPECTED_FILES = [
+    "books.csv",
+    "authors.csv",
+    "written_by.csv",
+    "users.csv",
+    "reviewed_by.csv",
+]
+
+
+@pytest.fixture
+def exported(tmp_path, monkeypatch):
+    """
+    Export the tiny cleaned books and ratings of fixtures/processed_data to tmp_path.
+    """
+    # the cleaned files are read from processed_data/ under the working directory
+    monkeypatch.chdir(FIXTURES)
+    exporter = BulkImportExporter(str(tmp_path))
+    books = exporter.export_books("books")
+    ratings = exporter.export_ratings("ratings", "books")
+    return tmp_path, books, ratings
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        return file.read()
+
+
+def test_export_counts(exported):
+    _, books, ratings = exported
+    # the second row of book 1 is a duplicate, "A Book Nobody Wrote" is unknown,
+    # "Neverwhere: A Novel" only matches a main title and the repeated rating of user 100
+    # is one edge
+    assert books == (4, 3, 5)
+    assert ratings == (3, 5, 2)
+
+
+@pytest.mark.parametrize("name", EXPECTED_FILES)
+def test_export_matches_expected_csv(exported, name):
+    output_dir, _, _ = exported
+    expected = read(os.path.join(FIXTURES, "bulk_import", name))
+    assert read(output_dir / name) == expected
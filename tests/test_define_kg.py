@@ -0,0 +1,75 @@
+import csv
+import re
+import pytest
+from define_kg import GraphCreator
+from preprocess_data import DataProcessor
+
+
+class RecordingDB:
+    """
+    Stand-in for Neo4jConnector keeping the statements of the rating transactions.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    def run_in_transaction(self, statements, write=True):
+        self.statements.extend(statements)
+        return [[] for _ in statements]
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    (tmp_path / "raw_data").mkdir()
+    (tmp_path / "processed_data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    write_csv(
+        tmp_path / "processed_data" / "books.csv",
+        [
+            "Id",
+            "Name",
+            "Authors",
+            "Rating",
+            "pagesNumber",
+            "PublishYear",
+            "Publisher",
+            "Language",
+            "Description",
+        ],
+        [["1", "Dune", "Frank Herbert", "4.2", "412", "1965", "Chilton", "eng", "None"]],
+    )
+    write_csv(
+        tmp_path / "raw_data" / "ratings.csv",
+        ["ID", "Name", "Rating"],
+        [
+            ["10", "Dune", "it was amazing"],
+            ["11", "Dune", "This user doesn't have any rating"],
+        ],
+    )
+    return tmp_path
+
+
+@pytest.mark.parametrize("parquet", [True, False])
+def test_unmapped_rating_label_is_written_without_num_rating(workdir, parquet):
+    processor = DataProcessor(fileoutput="ratings")
+    processor.reset_data()
+    processor.process_ratings_parallel(["ratings"], workers=1, parquet=parquet)
+    creator = GraphCreator()
+    creator.db = RecordingDB()
+    creator.reset_graph = lambda scope: None
+    creator.add_ratings_to_graph("ratings", books_filename="books")
+
+    [(query, parameters)] = creator.db.statements
+    rows = {row["user_id"]: row for row in parameters["rows"]}
+    assert rows["10"]["num_rating"] == 5
+    assert rows["11"]["num_rating"] is None
+    # MERGE fails on a null property, num_rating must only be SET
+    for properties in re.findall(r"MERGE [^\n]*?\{([^}]*)\}", query):
+        assert "num_rating" not in properties
@@ -0,0 +1,43 @@
+import csv
+import pytest
+from define_kg import BOOK_COLUMNS, GraphCreator
+from preprocess_data import DataProcessor
+
+
+def write_books(path, prefix, publishers, count=600):
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Id", "Name", "Authors", "Rating", "Publisher", "Language"])
+        for i in range(count):
+            writer.writerow(
+                [
+                    f"{prefix}{i}",
+                    f"Book {prefix}{i}",
+                    "An Author",
+                    4.0,
+                    f"Publisher {i % publishers}",
+                    "eng",
+                ]
+            )
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    (tmp_path / "raw_data").mkdir()
+    (tmp_path / "processed_data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parts_with_different_category_counts_read_back(workdir, workers):
+    # int8 dictionary codes for the first part, int16 ones for the second
+    write_books(workdir / "raw_data" / "small.csv", "s", publishers=3)
+    write_books(workdir / "raw_data" / "large.csv", "l", publishers=300)
+    processor = DataProcessor(fileoutput="books")
+    processor.reset_data()
+    processor.process_books_parallel(["small", "large"], workers=workers)
+    rows = list(GraphCreator().read_records("books", BOOK_COLUMNS))
+    assert len(rows) == 1200
+    assert len({row["Publisher"] for row in rows}) == 300
+    assert rows[0]["Id"] == "s0" and rows[-1]["Id"] == "l599"
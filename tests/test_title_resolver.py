@@ -0,0 +1,56 @@
+from title_resolver import MAIN_TITLE_SCORE, TitleResolver
+
+
+def make_resolver():
+    return TitleResolver.from_books(
+        [
+            {"name": "Dune", "id": "1"},
+            {"name": "The Hobbit: Or There and Back Again", "id": "2"},
+            {"name": "Good Omens (Discworld, #0)", "id": "3"},
+        ]
+    )
+
+
+def test_exact_titles_resolve_at_the_ratings_threshold():
+    resolver = make_resolver()
+    assert resolver.resolve_ids("dune", min_score=0.9) == ["1"]
+    assert resolver.resolve_ids("Good Omens", min_score=0.9) == ["3"]
+
+
+def test_main_title_matches_are_rejected_at_the_ratings_threshold():
+    resolver = make_resolver()
+    assert MAIN_TITLE_SCORE < 0.9
+    # the subtitle is missing on either side
+    assert resolver.resolve_ids("Dune: Messiah", min_score=0.9) == []
+    assert resolver.resolve_ids("The Hobbit", min_score=0.9) == []
+
+
+def test_main_title_matches_resolve_at_the_default_threshold():
+    resolver = make_resolver()
+    assert resolver.resolve("Dune: Messiah") == [("1", MAIN_TITLE_SCORE)]
+    assert resolver.resolve_ids("The Hobbit") == ["2"]
+
+
+def test_saved_resolver_answers_like_the_built_one(tmp_path):
+    resolver = make_resolver()
+    # a title shared by two books, and a main title shared by two titles
+    resolver.add("Dune", "4")
+    resolver.add("The Hobbit: An Illustrated Edition", "5")
+    resolver.save(tmp_path / "titles.pickle")
+    loaded = TitleResolver.load(tmp_path / "titles.pickle")
+    assert len(loaded) == len(resolver)
+    for title in [
+        "Dune",
+        "Dune: Messiah",
+        "The Hobbit",
+        "good omens",
+        "The Hobit: Or There and Back Again",
+        "Unknown Title",
+    ]:
+        assert loaded.resolve(title) == resolver.resolve(title)
+        assert loaded.resolve_ids(title) == resolver.resolve_ids(title)
+    assert loaded.resolve_ids("dune") == ["1", "4"]
+    # a loaded resolver saves the same index again
+    loaded.save(tmp_path / "again.pickle")
+    again = TitleResolver.load(tmp_path / "again.pickle")
+    assert again.resolve("The Hobbit") == resolver.resolve("The Hobbit")
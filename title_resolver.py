@@ -0,0 +1,361 @@
+import bisect
+import gc
+import itertools
+import logging
+import pickle
+import re
+import time
+from array import array
+from collections import Counter
+from DBPedia_index import normalize_name
+
+logger = logging.getLogger(__name__)
+
+# Trailing series information such as "(Harry Potter, #1)" or "[Book 2]"
+SERIES = re.compile(r"\s*[\(\[][^\(\)\[\]]*[\)\]]\s*$")
+
+# Leading articles ignored when comparing titles
+ARTICLES = ("the ", "a ", "an ")
+
+# Numbers of a title, fuzzy matches must have the same ("Volume 2" is not "Volume 3")
+NUMBER = re.compile(r"\d+")
+
+# Score of a title matching the main title (before the colon) of another, below the
+# min_score of 0.9 the ratings are resolved with: "Dune" is not always "Dune: Messiah"
+MAIN_TITLE_SCORE = 0.85
+
+
+def title_key(title):
+    """
+    Key under which titles are matched exactly: case, accents, punctuation, whitespace,
+    trailing series information and a leading article are ignored.
+    """
+    title = SERIES.sub("", title) or title
+    key = normalize_name(title.replace("&", " and "))
+    for article in ARTICLES:
+        if key.startswith(article):
+            return key[len(article) :]
+    return key
+
+
+def main_title_key(title):
+    """
+    Key of the title without its subtitle, None if it has none.
+    """
+    if ":" not in title:
+        return None
+    return title_key(title.split(":", 1)[0]) or None
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class StringTable:
+    """
+    Read-only sequence of strings stored as one string and the offsets of its items,
+    unpickled in a moment where a list of millions of strings takes seconds.
+    """
+
+    def __init__(self, strings):
+        strings = list(strings)
+        self.text = "".join(strings)
+        self.offsets = array(
+            "q", itertools.accumulate((len(string) for string in strings), initial=0)
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.text[self.offsets[index] : self.offsets[index + 1]]
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+
+class SortedIndex:
+    """
+    Read-only mapping of the distinct strings of a sequence to their position in it, or
+    to values[position], looked up by binary search instead of hashing. The strings are
+    not copied, only the array of their positions in sorted order is stored.
+    """
+
+    def __init__(self, strings, values=None):
+        self.strings = strings
+        self.values = values
+        self.order = array("i", sorted(range(len(strings)), key=strings.__getitem__))
+
+    def __len__(self):
+        return len(self.order)
+
+    def get(self, key, default=None):
+        if not isinstance(key, str):
+            return default
+        low = bisect.bisect_left(self.order, key, key=self.strings.__getitem__)
+        if low < len(self.order) and self.strings[self.order[low]] == key:
+            position = self.order[low]
+            return position if self.values is None else self.values[position]
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def items(self):
+        for position, key in enumerate(self.strings):
+            yield key, position if self.values is None else self.values[position]
+
+
+class TitleResolver:
+    # Bump when the keys or the saved layout change, files of other versions are rejected
+    VERSION = 2
+
+    def __init__(self, min_score=0.75, max_posting=20000, max_candidates=50):
+        """
+        In-memory index resolving book titles, such as rating titles or titles suggested
+        by the LLM, to Book ids without any database round trip. Titles are matched by
+        normalized key first, then by main title, then by trigram similarity.
+
+        :param min_score: Lowest trigram (Dice) similarity of a fuzzy match.
+        :param max_posting: Trigrams shared by more titles than this are only used to
+            find candidates when no rarer trigram did.
+        :param max_candidates: Number of candidates scored per fuzzy lookup.
+        """
+        self.min_score = min_score
+        self.max_posting = max_posting
+        self.max_candidates = max_candidates
+        # title key -> position in key_list and ids
+        self.keys = {}
+        self.key_list = []
+        # first book id of each title, and the other ids of the titles of several books
+        self.ids = []
+        self.more_ids = {}
+        # main title key -> first position of the titles having it, and the other ones
+        self.main_keys = {}
+        self.more_main_keys = {}
+        # trigram -> positions of the title keys containing it
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.key_list)
+
+    def add(self, title, book_id):
+        if not title:
+            return
+        key = title_key(title)
+        if not key:
+            return
+        index = self.keys.get(key)
+        if index is None:
+            index = self.keys[key] = len(self.key_list)
+            self.key_list.append(key)
+            self.ids.append(book_id)
+            for gram in trigrams(key):
+                postings = self.postings.get(gram)
+                if postings is None:
+                    postings = self.postings[gram] = array("i")
+                postings.append(index)
+            main_key = main_title_key(title)
+            if main_key and main_key != key:
+                first = self.main_keys.setdefault(main_key, index)
+                if first != index:
+                    self.more_main_keys.setdefault(main_key, []).append(index)
+        elif book_id != self.ids[index]:
+            # the same book can appear in several source shards
+            more_ids = self.more_ids.setdefault(index, [])
+            if book_id not in more_ids:
+                more_ids.append(book_id)
+
+    def book_ids(self, index):
+        """
+        Ids of the books whose title has the key at index.
+        """
+        return [self.ids[index], *self.more_ids.get(index, ())]
+
+    @classmethod
+    def from_books(cls, books, **kwargs):
+        """
+        Build a resolver from an iterable of dictionaries with the name and id of books.
+        """
+        start = time.perf_counter()
+        resolver = cls(**kwargs)
+        for book in books:
+            resolver.add(book["name"], book["id"])
+        logger.info(
+            f"Indexed {len(resolver)} distinct titles in {time.perf_counter() - start:.2f}s."
+        )
+        return resolver
+
+    @classmethod
+    def from_graph(cls, db, **kwargs):
+        """
+        Build a resolver from the Book nodes, read in one streamed query.
+        """
+        return cls.from_books(
+            db.stream_query(
+                "MATCH (b:Book) RETURN b.name AS name, b.id AS id", fetch_size=10000
+            ),
+            **kwargs,
+        )
+
+    def fuzzy(self, key):
+        """
+        Positions of the title keys similar to key, with their trigram similarity.
+        """
+        grams = trigrams(key)
+        numbers = NUMBER.findall(key)
+        counts = Counter()
+        # rarest trigrams first, they are the most selective
+        for postings in sorted(
+            (self.postings[gram] for gram in grams if gram in self.postings), key=len
+        ):
+            if len(postings) > self.max_posting:
+                if counts:
+                    break
+                postings = postings[: self.max_posting]
+            counts.update(postings)
+        matches = []
+        for index, _ in counts.most_common(self.max_candidates):
+            if NUMBER.findall(self.key_list[index]) != numbers:
+                continue
+            candidate = trigrams(self.key_list[index])
+            score = 2 * len(grams & candidate) / (len(grams) + len(candidate))
+            if score >= self.min_score:
+                matches.append((index, score))
+        matches.sort(key=lambda match: -match[1])
+        return matches
+
+    def matches(self, title):
+        """
+        Positions of the title keys matching title, best first, with their scores.
+        """
+        key = title_key(title) if title else ""
+        if not key:
+            return []
+        index = self.keys.get(key)
+        if index is not None:
+            return [(index, 1.0)]
+        main_key = main_title_key(title)
+        if main_key in self.keys:
+            return [(self.keys[main_key], MAIN_TITLE_SCORE)]
+        if key in self.main_keys:
+            indexes = [self.main_keys[key], *self.more_main_keys.get(key, ())]
+            return [(index, MAIN_TITLE_SCORE) for index in indexes]
+        return self.fuzzy(key)
+
+    def resolve(self, title, limit=3):
+        """
+        Candidate Book ids of title, best first.
+
+        :return: List of up to limit (id, score) pairs, the score being 1.0 for the same
+            normalized title, MAIN_TITLE_SCORE when one title is the other without its
+            subtitle, otherwise the trigram similarity.
+        """
+        candidates = []
+        for index, score in self.matches(title):
+            candidates.extend((book_id, score) for book_id in self.book_ids(index))
+            if len(candidates) >= limit:
+                break
+        return candidates[:limit]
+
+    def resolve_ids(self, title, min_score=None):
+        """
+        Ids of every book carrying the best match of title, if it scores at least
+        min_score (the resolver's min_score by default), otherwise an empty list.
+        """
+        matches = self.matches(title)
+        min_score = self.min_score if min_score is None else min_score
+        if not matches or matches[0][1] < min_score:
+            return []
+        return self.book_ids(matches[0][0])
+
+    def save(self, path):
+        """
+        Save the index in a layout made of few large objects, fast to unpickle: the
+        title keys are stored once, in a StringTable, and the dictionaries of the title
+        and main title keys as SortedIndex.
+        """
+        start = time.perf_counter()
+        key_list = StringTable(self.key_list)
+        main_keys = list(self.main_keys.items())
+        state = {
+            "version": self.VERSION,
+            "min_score": self.min_score,
+            "max_posting": self.max_posting,
+            "max_candidates": self.max_candidates,
+            "key_list": key_list,
+            "keys": SortedIndex(key_list),
+            # the ids read from the CSV or Parquet files are strings
+            "ids": (
+                StringTable(self.ids)
+                if all(isinstance(book_id, str) for book_id in self.ids)
+                else self.ids
+            ),
+            "more_ids": self.more_ids,
+            "main_keys": SortedIndex(
+                StringTable(key for key, _ in main_keys),
+                array("i", (index for _, index in main_keys)),
+            ),
+            "more_main_keys": self.more_main_keys,
+            # the postings of all the trigrams in one array, the trigram at position i
+            # having those from posting_offsets[i] to posting_offsets[i + 1]
+            "grams": list(self.postings),
+            "posting_offsets": array(
+                "q",
+                itertools.accumulate(
+                    (len(postings) for postings in self.postings.values()), initial=0
+                ),
+            ),
+            # bytes are unpickled with one copy, an array with two
+            "postings": array(
+                "i", itertools.chain.from_iterable(self.postings.values())
+            ).tobytes(),
+        }
+        with open(path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        logger.info(f"Saved the title index to '{path}' in {time.perf_counter() - start:.2f}s.")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a resolver saved by save. It answers lookups like the one saved, but is
+        read-only: titles cannot be added to it.
+        """
+        start = time.perf_counter()
+        # the cycle collector would otherwise run many times over the millions of
+        # objects created while unpickling
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as file:
+                state = pickle.load(file)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if state.get("version") != cls.VERSION:
+            raise ValueError(f"'{path}' was saved by another version of TitleResolver.")
+        resolver = cls(state["min_score"], state["max_posting"], state["max_candidates"])
+        resolver.key_list = state["key_list"]
+        resolver.keys = state["keys"]
+        resolver.ids = state["ids"]
+        resolver.more_ids = state["more_ids"]
+        resolver.main_keys = state["main_keys"]
+        resolver.more_main_keys = state["more_main_keys"]
+        # slices of a memoryview share the flat array instead of copying it
+        postings = memoryview(state["postings"]).cast("i")
+        offsets = state["posting_offsets"]
+        resolver.postings = {
+            gram: postings[offsets[i] : offsets[i + 1]]
+            for i, gram in enumerate(state["grams"])
+        }
+        logger.info(
+            f"Loaded {len(resolver)} titles from '{path}' in {time.perf_counter() - start:.2f}s."
+        )
+        return resolver